@@ -3,9 +3,18 @@ Offline Lichess-like Chess Application
 Main entry point - with notation scheme support
 """
 import sys
-import pygame
 import os
+# Keep stdout clean for the command-line tools
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import pygame
+try:
+    # Texture renderer backend; private pygame module, absent from some builds
+    from pygame._sdl2 import video as sdl2_video
+except ImportError:
+    sdl2_video = None
 import chess
+import chess.pgn
+import chess.polyglot
 import json
 from pathlib import Path
 from typing import Optional, Tuple, List
@@ -13,11 +22,42 @@ from dataclasses import dataclass
 from enum import Enum
 import subprocess
 import time
+import argparse
+import threading
+import selectors
+import socket
+import socketserver
+import struct
+import queue
+import signal
+import multiprocessing
+import weakref
+import cProfile
+import asyncio
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import csv
+import random
+import gzip
+import bz2
+import bisect
+import io
+import mmap
+from collections import deque
 
 
 # Linux standartlarına göre config dizinini belirle
 CONFIG_DIR = Path.home() / ".config" / "chess-app"
 CONFIG_FILE = CONFIG_DIR / "config.json"
+CACHE_DIR = CONFIG_DIR / "cache"
+ENGINE_SOCKET = CONFIG_DIR / "engine.sock"
+GAME_SOCKET = CONFIG_DIR / "game.sock"
+PUZZLE_DB = CONFIG_DIR / "puzzles.db"
+PROFILE_DIR = CONFIG_DIR / "profiles"
+ASSET_PACK = CONFIG_DIR / "assets.pack"
+# Loose asset files ship next to the module, independent of the working directory
+ASSETS_DIR = Path(__file__).resolve().parent / "assets"
 
 # Eğer config klasörü yoksa oluştur ve varsayılanları yaz
 if not CONFIG_DIR.exists():
@@ -29,10 +69,22 @@ if not CONFIG_DIR.exists():
 # Artık ayarları CONFIG_FILE üzerinden okuyabilirsin
 
 # Constants
+MAX_FRAME_SIZE = 1 << 20  # Largest accepted socket protocol frame (bytes)
 SQUARE_SIZE = 80
 BOARD_SIZE = 8
 WINDOW_SIZE = SQUARE_SIZE * BOARD_SIZE
 MIN_WINDOW_SIZE = 320  # Minimum pencere boyutu
+REPLAY_BAR_HEIGHT = 10  # Replay scrub bar at the bottom of the window
+EVAL_GRAPH_HEIGHT = 48  # Background analysis graph in a strip below the board
+
+# Custom pygame event carrying a finished engine search
+ENGINE_MOVE_EVENT = pygame.USEREVENT + 1
+# Custom pygame event carrying a spectator broadcast message
+BROADCAST_EVENT = pygame.USEREVENT + 2
+# Timer event: load the next puzzle after a solved one
+PUZZLE_NEXT_EVENT = pygame.USEREVENT + 3
+# Custom pygame event: background analysis finished a position
+ANALYSIS_EVENT = pygame.USEREVENT + 4
 
 class InputMode(Enum):
     NONE = 0
@@ -74,6 +126,16 @@ class Config:
         self.stockfish_depth = data.get('stockfish_depth', 1)
         self.stockfish_time = data.get('stockfish_time', 0.001)
         
+        # UCI options (Threads, Hash, ...) and strength presets written by chess-calibrate;
+        # a known 'strength' preset overrides stockfish_depth/stockfish_time
+        self.engine_options = data.get('engine_options', {})
+        self.strength_presets = data.get('strength_presets', {})
+        self.strength = data.get('strength', '')
+        preset = self.strength_presets.get(self.strength)
+        if preset:
+            self.stockfish_depth = preset.get('depth', self.stockfish_depth)
+            self.stockfish_time = preset.get('time', self.stockfish_time)
+        
         self.arrow_color = tuple(data.get('arrow_color', [255, 0, 0]))
         self.arrow_thickness = data.get('arrow_thickness', 15)
         self.circle_color = tuple(data.get('circle_color', [70, 115, 80]))
@@ -86,6 +148,7 @@ class Config:
         
         self.last_move_from_color = tuple(data.get('last_move_from_color', [205, 210, 106]))
         self.last_move_to_color = tuple(data.get('last_move_to_color', [170, 162, 58]))
+        self.premove_color = tuple(data.get('premove_color', [20, 85, 160]))
         
         self.board_theme = data.get('board_theme', 'brown')
         self.piece_theme = data.get('piece_theme', 'cburnett')
@@ -100,6 +163,61 @@ class Config:
         
         # Starting position FEN
         self.starting_fen = data.get('starting_fen', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+        
+        # Frame-rate caps per UI state; 0 = display refresh rate
+        # (for idle, 0 = sleep until the next event)
+        self.fps_idle = data.get('fps_idle', 0)
+        self.fps_interactive = data.get('fps_interactive', 0)
+        self.fps_animating = data.get('fps_animating', 0)
+        
+        # Spectator broadcast: address to publish this game on / address to watch
+        self.broadcast = data.get('broadcast', '')
+        self.spectate = data.get('spectate', '')
+        
+        # Puzzle mode (puzzles imported with chess-puzzles)
+        self.puzzle_mode = data.get('puzzle_mode', False)
+        self.puzzle_db = data.get('puzzle_db', str(PUZZLE_DB))
+        self.puzzle_rating_min = data.get('puzzle_rating_min', 0)
+        self.puzzle_rating_max = data.get('puzzle_rating_max', 4000)
+        self.puzzle_theme = data.get('puzzle_theme', '')
+        
+        # Headless game server (socket path or host:port); empty = local game
+        self.game_server = data.get('game_server', '')
+        
+        # Shared engine daemon (socket path or host:port); empty = own engine process
+        self.engine_daemon = data.get('engine_daemon', '')
+        
+        # Background analysis of the game with a separate low-priority engine;
+        # analysis_threads 0 = cores left over by the playing engine
+        self.analysis = data.get('analysis', False)
+        self.analysis_depth = data.get('analysis_depth', 12)
+        self.analysis_threads = data.get('analysis_threads', 0)
+        
+        # Extra seconds an engine may take beyond the expected time before it is restarted
+        self.engine_timeout = data.get('engine_timeout', 5.0)
+        
+        # Drawing backend: 'surface' (software blits) or 'texture' (SDL2 renderer,
+        # GPU if present); falls back to 'surface' when the renderer cannot start
+        self.render_backend = data.get('render_backend', 'surface')
+        
+        # Memory cap (MB) for decoded images and sounds; 0 = unlimited
+        self.asset_memory_mb = data.get('asset_memory_mb', 32)
+        # Packed assets built by chess-assets; loose files are used when missing
+        self.asset_pack = data.get('asset_pack', str(ASSET_PACK))
+        
+        # How often (seconds) the config file is checked for changes
+        self.config_poll_interval = data.get('config_poll_interval', 1.0)
+    
+    def snapshot(self) -> dict:
+        """Current setting values, used to diff reloads"""
+        return {key: value for key, value in vars(self).items() if key != 'config_path'}
+    
+    def reload(self) -> set:
+        """Re-read the config file and return the names of changed settings"""
+        before = self.snapshot()
+        self.load()
+        after = self.snapshot()
+        return {key for key, value in after.items() if before.get(key) != value}
     
     def get_defaults(self):
         return {
@@ -107,6 +225,9 @@ class Config:
             'stockfish_path': '/usr/bin/stockfish',
             'stockfish_depth': 1,
             'stockfish_time': 0.001,
+            'engine_options': {},
+            'strength_presets': {},
+            'strength': '',
             'arrow_color': [255, 0, 0],
             'arrow_thickness': 15,
             'circle_color': [70, 115, 80],
@@ -117,17 +238,193 @@ class Config:
             'marker_radius_ratio': 0.9,
             'last_move_from_color': [205, 210, 106],
             'last_move_to_color': [170, 162, 58],
+            'premove_color': [20, 85, 160],
             'board_theme': 'brown',
             'piece_theme': 'cburnett',
             'play_sounds': True,
             'notation_scheme': 'algebraic',
-            'starting_fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+            'starting_fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+            'puzzle_mode': False,
+            'puzzle_db': str(PUZZLE_DB),
+            'puzzle_rating_min': 0,
+            'puzzle_rating_max': 4000,
+            'puzzle_theme': '',
+            'broadcast': '',
+            'spectate': '',
+            'game_server': '',
+            'engine_daemon': '',
+            'engine_timeout': 5.0,
+            'analysis': False,
+            'analysis_depth': 12,
+            'analysis_threads': 0,
+            'fps_idle': 0,
+            'fps_interactive': 0,
+            'fps_animating': 0,
+            'render_backend': 'surface',
+            'asset_memory_mb': 32,
+            'asset_pack': str(ASSET_PACK),
+            'config_poll_interval': 1.0
         }
     
     def save(self, data):
         with open(self.config_path, 'w') as f:
             json.dump(data, f, indent=2)
 
+class ConfigWatcher:
+    """Detect config file edits by cheap stat polling"""
+    
+    def __init__(self, config: Config):
+        self.config = config
+        self.last_check = time.monotonic()
+        self.last_stat = self._stat()
+    
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.config.config_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    
+    def poll(self) -> set:
+        """Return changed setting names, or an empty set if nothing changed"""
+        now = time.monotonic()
+        if now - self.last_check < self.config.config_poll_interval:
+            return set()
+        self.last_check = now
+        
+        stat = self._stat()
+        if stat is None or stat == self.last_stat:
+            return set()
+        self.last_stat = stat
+        
+        try:
+            return self.config.reload()
+        except (OSError, ValueError) as e:
+            # Probably a half-written file; the next write changes the stat again
+            print(f"Config reload failed: {e}")
+            return set()
+
+class FrameState(Enum):
+    IDLE = 0
+    INTERACTIVE = 1  # Dragging a piece
+    ANIMATING = 2
+
+class FrameScheduler:
+    """Pace the main loop: block on events when idle, run at refresh rate when busy"""
+    
+    def __init__(self, config: Config):
+        self.config = config
+        self.clock = pygame.time.Clock()
+        self.refresh_rate = self._display_refresh_rate()
+    
+    @staticmethod
+    def _display_refresh_rate() -> int:
+        try:
+            rates = pygame.display.get_desktop_refresh_rates()
+        except (AttributeError, pygame.error):
+            rates = []
+        return max(rates) if rates and max(rates) > 0 else 60
+    
+    def fps_for(self, state: FrameState) -> int:
+        if state == FrameState.ANIMATING:
+            fps = self.config.fps_animating
+        elif state == FrameState.INTERACTIVE:
+            fps = self.config.fps_interactive
+        else:
+            return self.config.fps_idle
+        return fps or self.refresh_rate
+    
+    def next_events(self, state: FrameState) -> List[pygame.event.Event]:
+        """Wait for the next frame (or event, when idle) and return pending events"""
+        fps = self.fps_for(state)
+        if fps:
+            self.clock.tick(fps)
+            return pygame.event.get()
+        
+        # Idle: sleep in the event queue; wake up for config polling
+        timeout = max(1, int(self.config.config_poll_interval * 1000))
+        event = pygame.event.wait(timeout)
+        events = [] if event.type == pygame.NOEVENT else [event]
+        events.extend(pygame.event.get())
+        # Keep the clock from reporting one huge frame after waking up
+        self.clock.tick()
+        return events
+
+class ProfileSession:
+    """On-demand profiling: cProfile on the calling thread plus a stack sampler over all threads
+
+    cProfile gives exact call counts for the main loop; the sampler also sees
+    engine, broadcast and puzzle threads and yields collapsed stacks for
+    flame graphs (flamegraph.pl, speedscope, inferno).
+    """
+    
+    def __init__(self, sample_interval: float = 0.005):
+        self.sample_interval = sample_interval
+        self.samples = {}
+        self.sample_count = 0
+        self.started = time.monotonic()
+        self._stop = threading.Event()
+        
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Another profiler is already active (e.g. running under cProfile)
+            self.profile = None
+        self._sampler = threading.Thread(target=self._sample, daemon=True, name='profile-sampler')
+        self._sampler.start()
+    
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+    
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.sample_count += 1
+    
+    def stop(self, tags: dict) -> List[Path]:
+        """Stop profiling and write <name>.pstats, <name>.folded and <name>.json; returns the paths"""
+        self._stop.set()
+        self._sampler.join()
+        if self.profile:
+            self.profile.disable()
+        
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        # Size and theme in the file name so captures sort and compare at a glance
+        stem = '_'.join([time.strftime('%Y%m%d-%H%M%S')] +
+                        [str(tags[key]) for key in ('window', 'board_theme', 'piece_theme') if key in tags])
+        base = PROFILE_DIR / stem
+        paths = []
+        
+        if self.profile:
+            self.profile.dump_stats(str(base.with_suffix('.pstats')))
+            paths.append(base.with_suffix('.pstats'))
+        
+        with open(base.with_suffix('.folded'), 'w') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        paths.append(base.with_suffix('.folded'))
+        
+        meta = dict(tags, duration=round(time.monotonic() - self.started, 3),
+                    samples=self.sample_count, sample_interval=self.sample_interval)
+        with open(base.with_suffix('.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        paths.append(base.with_suffix('.json'))
+        return paths
+
 class NotationConverter:
     """Convert moves between different notation schemes"""
     
@@ -164,8 +461,14 @@ class NotationConverter:
         return notation
     
     @staticmethod
-    def to_descriptive(move: chess.Move, board: chess.Board) -> str:
-        """Convert to descriptive notation (old English style)"""
+    def to_descriptive(move: chess.Move, board: chess.Board,
+                       is_capture: Optional[bool] = None,
+                       is_castling: Optional[bool] = None) -> str:
+        """Convert to descriptive notation (old English style)
+
+        Callers that already know the capture/castling flags (e.g. from SAN)
+        can pass them to skip recomputing them on the board.
+        """
         piece = board.piece_at(move.from_square)
         if not piece:
             return move.uci()
@@ -202,13 +505,16 @@ class NotationConverter:
         file_name = file_map.get(to_file, 'K')
         
         # Determine if capture
-        is_capture = board.is_capture(move)
+        if is_capture is None:
+            is_capture = board.is_capture(move)
         separator = 'x' if is_capture else '-'
         
         notation = f"{piece_symbol}{separator}{file_name}{display_rank}"
         
         # Add special notations
-        if board.is_castling(move):
+        if is_castling is None:
+            is_castling = board.is_castling(move)
+        if is_castling:
             if to_file > from_file:
                 return "O-O"
             else:
@@ -224,249 +530,2481 @@ class NotationConverter:
         """Convert current board position to FEN notation"""
         return board.fen()
 
-class StockfishEngine:
-    def __init__(self, path: str, depth: int = 15, time_limit: float = 1.0):
-        self.process = subprocess.Popen(
-            [path],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            bufsize=1
+@dataclass
+class PlyNotation:
+    """All notations of a single ply, computed once from the position before it"""
+    move: chess.Move
+    color: chess.Color
+    san: str
+    descriptive: str
+    fen: str  # Position after the move
+    
+    @classmethod
+    def from_board(cls, move: chess.Move, board: chess.Board) -> 'PlyNotation':
+        """Build the record; board must be the position before the move"""
+        # board.san() is the only call that generates legal moves
+        san = board.san(move)
+        descriptive = NotationConverter.to_descriptive(
+            move, board,
+            is_capture='x' in san,
+            is_castling=san.startswith('O-O')
         )
+        color = board.turn
+        board.push(move)
+        fen = board.fen()
+        board.pop()
+        return cls(move, color, san, descriptive, fen)
+    
+    def sound(self) -> str:
+        """Sound cue for this ply, read from the SAN mate/check/capture markers"""
+        if self.san.endswith('#'):
+            return 'end'
+        elif self.san.endswith('+'):
+            return 'check'
+        elif self.move.promotion:
+            return 'promote'
+        elif self.san.startswith('O-O'):
+            return 'castle'
+        elif 'x' in self.san:
+            return 'capture'
+        return 'move'
+    
+    def format(self, scheme: NotationScheme) -> str:
+        """Return the memoized notation for the given scheme"""
+        if scheme == NotationScheme.COORDINATE:
+            return NotationConverter.to_coordinate(self.move)
+        elif scheme == NotationScheme.ICCF:
+            return NotationConverter.to_iccf(self.move)
+        elif scheme == NotationScheme.DESCRIPTIVE:
+            return self.descriptive
+        elif scheme == NotationScheme.FEN:
+            return self.fen
+        return self.san
+
+class NotationStream:
+    """Incremental whole-game notation converter with per-ply memoization"""
+    
+    def __init__(self, starting_fen: str = chess.STARTING_FEN):
+        self.board = chess.Board(starting_fen)
+        self.plies: List[PlyNotation] = []
+    
+    def push(self, move: chess.Move) -> PlyNotation:
+        ply = PlyNotation.from_board(move, self.board)
+        self.board.push(move)
+        self.plies.append(ply)
+        return ply
+    
+    def push_uci(self, uci: str) -> PlyNotation:
+        move = chess.Move.from_uci(uci)
+        if not self.board.is_legal(move):
+            raise ValueError(f"illegal move {uci} in {self.board.fen()}")
+        return self.push(move)
+    
+    def pop(self) -> PlyNotation:
+        self.board.pop()
+        return self.plies.pop()
+    
+    def export(self, scheme: NotationScheme) -> List[str]:
+        """Return every ply in the given scheme without touching the board"""
+        return [ply.format(scheme) for ply in self.plies]
+
+def iter_games(stream, input_format: str):
+    """Yield (location, starting_fen, moves) for each game in a PGN or UCI move-list stream
+
+    UCI input holds one game per line; a line may start with a FEN followed
+    by ';' to set the starting position. UCI moves are yielded as unparsed
+    strings so a bad token only affects its own game.
+    """
+    if input_format == 'pgn':
+        index = 0
+        while True:
+            game = chess.pgn.read_game(stream)
+            if game is None:
+                break
+            index += 1
+            if game.errors:
+                print(f"Skipping game {index}: {game.errors[0]}", file=sys.stderr)
+                continue
+            yield f"game {index}", game.board().fen(), game.mainline_moves()
+    else:
+        for index, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fen = chess.STARTING_FEN
+            if ';' in line:
+                fen, line = (part.strip() for part in line.split(';', 1))
+            yield f"line {index}", fen, line.split()
+
+def convert_games(stream, input_format: str, scheme: NotationScheme):
+    """Stream-convert games; yields one list of notations per game
+
+    Games with an invalid FEN or an illegal move are reported on stderr and
+    skipped.
+    """
+    for location, fen, moves in iter_games(stream, input_format):
+        try:
+            notation = NotationStream(fen)
+            for move in moves:
+                if isinstance(move, str):
+                    notation.push_uci(move)
+                else:
+                    notation.push(move)
+        except ValueError as e:
+            print(f"Skipping {location}: {e}", file=sys.stderr)
+            continue
+        yield notation.export(scheme)
+
+def notation_main(argv: Optional[List[str]] = None):
+    """Command-line bulk converter: PGN / UCI move lists -> any notation scheme"""
+    parser = argparse.ArgumentParser(
+        prog='chess-notation',
+        description='Convert PGN or UCI move lists to another notation scheme'
+    )
+    parser.add_argument('input', nargs='?', default='-',
+                        help="input file ('-' for stdin)")
+    parser.add_argument('-s', '--scheme', default=NotationScheme.ALGEBRAIC.value,
+                        choices=[scheme.value for scheme in NotationScheme])
+    parser.add_argument('-f', '--input-format', choices=['pgn', 'uci'],
+                        help='input format (default: guessed from file extension)')
+    parser.add_argument('-o', '--output', default='-',
+                        help="output file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    
+    input_format = args.input_format
+    if input_format is None:
+        input_format = 'pgn' if args.input.lower().endswith('.pgn') else 'uci'
+    scheme = NotationScheme(args.scheme)
+    # FEN output has one position per ply, other schemes one game per line
+    separator = '\n' if scheme == NotationScheme.FEN else ' '
+    
+    source = sys.stdin if args.input == '-' else open(args.input, 'r')
+    target = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for notations in convert_games(source, input_format, scheme):
+            target.write(separator.join(notations) + '\n')
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+def latency_stats(latencies, restarts: int) -> dict:
+    """Search count, restart count and latency percentiles (seconds)"""
+    latencies = sorted(latencies)
+    
+    def percentile(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    
+    return {
+        'searches': len(latencies),
+        'restarts': restarts,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': latencies[-1] if latencies else 0.0
+    }
+
+def parse_info(line: str) -> dict:
+    """Parse the numeric fields, score and pv of a UCI 'info' line"""
+    tokens = line.split()
+    info = {}
+    i = 1
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ('depth', 'seldepth', 'nodes', 'nps', 'time', 'multipv', 'hashfull') and i + 1 < len(tokens):
+            try:
+                info[token] = int(tokens[i + 1])
+            except ValueError:
+                pass
+            i += 2
+        elif token == 'score' and i + 2 < len(tokens):
+            # Scores are from the side to move's point of view
+            kind, value = tokens[i + 1], tokens[i + 2]
+            if kind == 'cp':
+                info['score'] = int(value)
+                info.pop('mate', None)
+            elif kind == 'mate':
+                info['mate'] = int(value)
+                info.pop('score', None)
+            i += 3
+        elif token == 'pv':
+            info['pv'] = tokens[i + 1:]
+            break
+        elif token == 'string':
+            break
+        else:
+            i += 1
+    return info
+
+class EngineError(Exception):
+    """Engine process crashed, closed its pipes or could not be started"""
+
+class EngineTimeout(EngineError):
+    """Engine did not answer before the command deadline"""
+
+class StockfishEngine:
+    def __init__(self, path: str, depth: int = 15, time_limit: float = 1.0, timeout: float = 5.0,
+                 options: Optional[dict] = None, niceness: int = 0):
+        self.path = path
         self.depth = depth
         self.time_limit = time_limit
-        self._send('uci')
-        self._wait_for('uciok')
-        self._send('isready')
-        self._wait_for('readyok')
+        # Grace period on top of every command's expected duration
+        self.timeout = timeout
+        # UCI options, sent on start and replayed after a restart
+        self.options = dict(options or {})
+        # CPU priority increment for background engines (also after restarts)
+        self.niceness = niceness
+        # Set by stop(); a search started after the request is stopped at once
+        self.stop_requested = False
+        
+        # Metrics
+        self.restarts = 0
+        self.latencies = deque(maxlen=1000)
+        
+        self.process = None
+        self._start()
+    
+    def _start(self):
+        try:
+            self.process = subprocess.Popen(
+                [self.path],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,  # Never read; a full stderr pipe would block the engine
+                bufsize=0
+            )
+        except OSError as e:
+            # Missing or non-executable binary, also when it disappears before a restart
+            raise EngineError(f"cannot start {self.path}: {e}")
+        if self.niceness:
+            try:
+                os.setpriority(os.PRIO_PROCESS, self.process.pid, self.niceness)
+            except (AttributeError, OSError):
+                pass  # Not supported here; run at normal priority
+        self._buffer = b''
+        self._stdout_fd = self.process.stdout.fileno()
+        os.set_blocking(self._stdout_fd, False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._stdout_fd, selectors.EVENT_READ)
+        
+        try:
+            self._send('uci')
+            self._wait_for('uciok', self.timeout)
+            for name, value in self.options.items():
+                self._send(f'setoption name {name} value {value}')
+            self._send('isready')
+            self._wait_for('readyok', self.timeout)
+        except EngineError:
+            self._kill()
+            raise
     
     def _send(self, command: str):
-        self.process.stdin.write(command + '\n')
-        self.process.stdin.flush()
+        try:
+            self.process.stdin.write((command + '\n').encode())
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise EngineError(f"engine input closed: {e}")
+    
+    def _readline(self, deadline: float) -> str:
+        """Read one line without blocking past the deadline (monotonic time)"""
+        while b'\n' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise EngineTimeout("engine did not answer in time")
+            if not self._selector.select(remaining):
+                continue
+            try:
+                chunk = os.read(self._stdout_fd, 65536)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                raise EngineError(f"engine output closed: {e}")
+            if not chunk:
+                raise EngineError("engine exited")
+            self._buffer += chunk
+        
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode(errors='replace').strip()
     
-    def _wait_for(self, text: str):
+    def _wait_for(self, text: str, timeout: float):
+        deadline = time.monotonic() + timeout
         while True:
-            line = self.process.stdout.readline().strip()
+            line = self._readline(deadline)
             if text in line:
-                break
+                return line
     
-    def get_best_move(self, board: chess.Board) -> Optional[chess.Move]:
-        self._send(f'position fen {board.fen()}')
-        self._send(f'go depth {self.depth} movetime {int(self.time_limit * 1000)}')
-        
-        best_move = None
+    def _read_result(self, deadline: float) -> dict:
+        """Collect 'info' fields until 'bestmove'; the result has 'move' plus the last info values"""
+        result = {}
         while True:
-            line = self.process.stdout.readline().strip()
-            if line.startswith('bestmove'):
-                move_str = line.split()[1]
-                best_move = chess.Move.from_uci(move_str)
-                break
+            line = self._readline(deadline)
+            if line.startswith('info'):
+                result.update(parse_info(line))
+            elif line.startswith('bestmove'):
+                parts = line.split()
+                if len(parts) < 2 or parts[1] in ('(none)', '0000'):
+                    result['move'] = None
+                else:
+                    try:
+                        result['move'] = chess.Move.from_uci(parts[1])
+                    except ValueError:
+                        raise EngineError(f"malformed engine reply: {line}")
+                return result
+    
+    def _go(self, board: chess.Board, limit: str, expected_time: float) -> dict:
+        # Send the game from its root so the engine sees repetitions
+        position = f'position fen {board.root().fen()}'
+        if board.move_stack:
+            position += ' moves ' + ' '.join(move.uci() for move in board.move_stack)
+        self._send(position)
+        self._send(f'go {limit}')
+        if self.stop_requested:
+            # stop() arrived before this search started
+            self._send('stop')
         
+        deadline = time.monotonic() + expected_time + self.timeout
+        try:
+            return self._read_result(deadline)
+        except EngineTimeout:
+            # Ask for the best move so far before giving up on the process
+            self._send('stop')
+            return self._read_result(time.monotonic() + 1.0)
+    
+    def _search(self, board: chess.Board) -> Optional[chess.Move]:
+        limit = f'depth {self.depth} movetime {int(self.time_limit * 1000)}'
+        return self._go(board, limit, self.time_limit)['move']
+    
+    def get_best_move(self, board: chess.Board) -> Optional[chess.Move]:
+        """Search the position; a hung or crashed engine is restarted once"""
+        start = time.monotonic()
+        try:
+            best_move = self._search(board)
+        except EngineError as e:
+            print(f"Engine failed ({e}), restarting")
+            self.restart()
+            best_move = self._search(board)
+        self.latencies.append(time.monotonic() - start)
         return best_move
     
+    def analyse(self, board: chess.Board, limit: str, expected_time: float = 1.0) -> dict:
+        """Run 'go <limit>' (e.g. 'nodes 1000000') and return the final search info
+
+        Keys: 'move' and, when reported, 'depth', 'nodes', 'nps', 'time', 'score', 'mate', 'pv'.
+        """
+        try:
+            return self._go(board, limit, expected_time)
+        except EngineError as e:
+            print(f"Engine failed ({e}), restarting")
+            self.restart()
+            return self._go(board, limit, expected_time)
+    
+    def stop(self):
+        """Make a running search return now; may be called from another thread"""
+        self.stop_requested = True
+        try:
+            self._send('stop')
+        except EngineError:
+            pass
+    
+    def new_game(self):
+        """Start an unrelated game: the engine clears its hash before answering isready"""
+        self._send('ucinewgame')
+        self._send('isready')
+        self._wait_for('readyok', self.timeout)
+    
+    def set_option(self, name: str, value):
+        """Send a UCI option and remember it for restarts"""
+        self.options[name] = value
+        self._send(f'setoption name {name} value {value}')
+    
+    def ping(self) -> bool:
+        """Health check: the engine answers isready within the timeout"""
+        try:
+            self._send('isready')
+            self._wait_for('readyok', self.timeout)
+            return True
+        except EngineError:
+            return False
+    
+    def restart(self):
+        """Kill the current process and start a fresh one with the same options"""
+        self.restarts += 1
+        self._kill()
+        self._start()
+    
+    def stats(self) -> dict:
+        return latency_stats(self.latencies, self.restarts)
+    
+    def configure(self, depth: int, time_limit: float, timeout: float):
+        """Update search limits; they are sent with every 'go', no restart needed"""
+        self.depth = depth
+        self.time_limit = time_limit
+        self.timeout = timeout
+    
+    def _kill(self):
+        self._selector.close()
+        self.process.kill()
+        try:
+            self.process.wait(timeout=1.0)
+        except subprocess.TimeoutExpired:
+            pass
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+    
     def close(self):
-        self._send('quit')
-        self.process.terminate()
+        try:
+            self._send('quit')
+            self.process.wait(timeout=1.0)
+        except (EngineError, subprocess.TimeoutExpired):
+            pass
+        self._kill()
 
-class AssetManager:
-    def __init__(self, config: Config):
-        self.config = config
-        self.assets_dir = Path('assets')
-        self.pieces_dir = self.assets_dir / 'pieces' / config.piece_theme
-        self.sounds_dir = self.assets_dir / 'sounds'
-        self.boards_dir = self.assets_dir / 'boards'
-        
-        self.pieces = {}
-        self.sounds = {}
-        self.board_image = None
-        self.check_image = None
-        
-        self._ensure_directories()
-        self._load_pieces()
-        self._load_sounds()
-        self._load_board_theme()
-        self._load_check_indicator()
+def parse_address(address: str) -> Tuple[int, object]:
+    """'host:port' -> TCP, anything else is a Unix socket path"""
+    if not address.startswith('/') and ':' in address:
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+def encode_frame(message: dict) -> bytes:
+    """Length-prefixed (4-byte big-endian) JSON frame"""
+    payload = json.dumps(message, separators=(',', ':')).encode()
+    return struct.pack('>I', len(payload)) + payload
+
+def send_frame(sock: socket.socket, message: dict):
+    sock.sendall(encode_frame(message))
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            if data:
+                raise ConnectionError("connection closed mid-frame")
+            return None
+        data += chunk
+    return data
+
+def recv_frame(sock: socket.socket) -> Optional[dict]:
+    """Read one frame; None on a clean end of stream"""
+    header = _recv_exact(sock, 4)
+    if header is None:
+        return None
+    (size,) = struct.unpack('>I', header)
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionError(f"frame too large ({size} bytes)")
+    payload = _recv_exact(sock, size)
+    if payload is None:
+        raise ConnectionError("connection closed mid-frame")
+    return json.loads(payload)
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[dict]:
+    """asyncio counterpart of recv_frame"""
+    try:
+        header = await reader.readexactly(4)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError("connection closed mid-frame")
+        return None
+    (size,) = struct.unpack('>I', header)
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionError(f"frame too large ({size} bytes)")
+    try:
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("connection closed mid-frame")
+    return json.loads(payload)
+
+async def write_frame(writer: asyncio.StreamWriter, message: dict):
+    writer.write(encode_frame(message))
+    await writer.drain()
+
+class EngineDaemon:
+    """Owns a fixed set of warm engines and serves searches over a local socket"""
     
-    def _ensure_directories(self):
-        self.assets_dir.mkdir(exist_ok=True)
-        self.pieces_dir.mkdir(parents=True, exist_ok=True)
-        self.sounds_dir.mkdir(parents=True, exist_ok=True)
-        self.boards_dir.mkdir(parents=True, exist_ok=True)
+    def __init__(self, path: str, engines: int = 2, timeout: float = 5.0, options: Optional[dict] = None):
+        self.engines = []
+        self.idle_engines = queue.Queue()
+        for _ in range(engines):
+            engine = StockfishEngine(path, timeout=timeout, options=options)
+            self.engines.append(engine)
+            self.idle_engines.put(engine)
     
-    def _load_pieces(self):
-        piece_types = ['P', 'N', 'B', 'R', 'Q', 'K']
-        colors = ['w', 'b']
+    def handle_request(self, request: dict) -> dict:
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True}
+        if op == 'stats':
+            return {'ok': True, 'engines': [engine.stats() for engine in self.engines]}
+        if op != 'bestmove':
+            return {'ok': False, 'error': f"unknown op {op!r}"}
         
-        for color in colors:
-            for piece in piece_types:
-                key = f"{color}{piece}"
-                png_path = self.pieces_dir / f"{key}.png"
-                
-                if png_path.exists():
-                    self.pieces[key] = pygame.image.load(str(png_path))
+        board = chess.Board(request['fen'])
+        for uci in request.get('moves', []):
+            board.push_uci(uci)
+        
+        # Blocks until one of the warm engines is free
+        engine = self.idle_engines.get()
+        try:
+            engine.configure(request.get('depth', engine.depth),
+                             request.get('movetime', engine.time_limit),
+                             engine.timeout)
+            move = engine.get_best_move(board)
+        finally:
+            self.idle_engines.put(engine)
+        return {'ok': True, 'move': move.uci() if move else None}
     
-    def _load_sounds(self):
-        sound_files = {
-            'Move': 'move',
-            'Capture': 'capture',
-            'Castle': 'castle',
-            'Check': 'check',
-            'Promote': 'promote',
-            'GameEnd': 'end',
-            'GenericNotify': 'notify'
-        }
+    def serve(self, address: str):
+        family, bind_address = parse_address(address)
+        daemon = self
         
-        for filename, key in sound_files.items():
-            for ext in ['.ogg', '.mp3', '.wav']:
-                filepath = self.sounds_dir / f"{filename}{ext}"
-                if filepath.exists():
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                # Connections are persistent: serve frames until the client hangs up
+                while True:
                     try:
-                        self.sounds[key] = pygame.mixer.Sound(str(filepath))
-                        break
-                    except:
-                        continue
-    
-    def _load_board_theme(self):
-        board_path = self.boards_dir / f"{self.config.board_theme}.png"
+                        request = recv_frame(self.request)
+                    except (OSError, ValueError):
+                        return
+                    if request is None:
+                        return
+                    try:
+                        response = daemon.handle_request(request)
+                    except (EngineError, ValueError, KeyError) as e:
+                        response = {'ok': False, 'error': str(e)}
+                    try:
+                        send_frame(self.request, response)
+                    except OSError:
+                        return
         
-        if board_path.exists():
-            self.board_image = pygame.image.load(str(board_path))
-    
-    def _load_check_indicator(self):
-        check_path = self.assets_dir / 'check.png'
+        if family == socket.AF_UNIX:
+            # Remove a stale socket left by a previous run
+            if os.path.exists(bind_address):
+                os.unlink(bind_address)
+            server = socketserver.ThreadingUnixStreamServer(bind_address, Handler)
+        else:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            server = socketserver.ThreadingTCPServer(bind_address, Handler)
+        server.daemon_threads = True
         
-        if check_path.exists():
-            self.check_image = pygame.image.load(str(check_path))
+        print(f"Engine daemon: {len(self.engines)} engines on {address}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if family == socket.AF_UNIX and os.path.exists(bind_address):
+                os.unlink(bind_address)
+            self.close()
     
-    def get_piece_image(self, piece: chess.Piece, size: Tuple[int, int]) -> Optional[pygame.Surface]:
-        """Get piece image scaled to (width, height) tuple"""
-        color = 'w' if piece.color == chess.WHITE else 'b'
-        piece_type = piece.symbol().upper()
-        key = f"{color}{piece_type}"
-        
-        if key in self.pieces:
-            return pygame.transform.smoothscale(self.pieces[key], size)
-        
-        # Fallback: render text
-        avg_size = (size[0] + size[1]) // 2
-        font = pygame.font.Font(None, avg_size)
-        symbols = {'P': '♙♟', 'N': '♘♞', 'B': '♗♝', 'R': '♖♜', 'Q': '♕♛', 'K': '♔♚'}
-        symbol = symbols[piece_type][0 if piece.color == chess.WHITE else 1]
-        text = font.render(symbol, True, (255, 255, 255) if piece.color == chess.WHITE else (0, 0, 0))
-        return text
+    def close(self):
+        for engine in self.engines:
+            engine.close()
+
+class EngineClient:
+    """StockfishEngine-compatible client for a shared EngineDaemon"""
     
-    def get_board_surface(self, width: int, height: int) -> pygame.Surface:
-        """Get board surface scaled to given width and height"""
-        if self.board_image:
-            return pygame.transform.smoothscale(self.board_image, (width, height))
-        
-        # Fallback: solid colors (brown theme) - rectangular squares
-        surface = pygame.Surface((width, height))
-        sq_w = width // 8
-        sq_h = height // 8
-        light = (240, 217, 181)
-        dark = (181, 136, 99)
+    # Idle persistent connections per daemon address, shared by every client in the process
+    _pools = {}
+    _pools_lock = threading.Lock()
+    
+    def __init__(self, address: str, depth: int = 15, time_limit: float = 1.0, timeout: float = 5.0):
+        self.address = address
+        self.depth = depth
+        self.time_limit = time_limit
+        self.timeout = timeout
         
-        for rank in range(8):
-            for file in range(8):
-                color = light if (file + rank) % 2 == 1 else dark
-                pygame.draw.rect(surface, color, (file * sq_w, rank * sq_h, sq_w, sq_h))
+        # Metrics; a restart here is a reconnect
+        self.restarts = 0
+        self.latencies = deque(maxlen=1000)
         
-        return surface
+        if not self.ping():
+            raise EngineError(f"engine daemon not reachable at {address}")
     
-    def get_check_indicator(self, width: int, height: int) -> Optional[pygame.Surface]:
-        """Get check indicator scaled to square size (width x height)"""
-        if self.check_image:
-            return pygame.transform.smoothscale(self.check_image, (width, height))
+    def _acquire(self) -> socket.socket:
+        with self._pools_lock:
+            pool = self._pools.setdefault(self.address, [])
+            if pool:
+                return pool.pop()
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    
+    def _release(self, sock: socket.socket):
+        with self._pools_lock:
+            self._pools.setdefault(self.address, []).append(sock)
+    
+    def _request(self, message: dict, timeout: float) -> dict:
+        error = None
+        # A pooled connection may have been closed by a restarted daemon: retry once
+        for _ in range(2):
+            try:
+                sock = self._acquire()
+            except OSError as e:
+                error = e
+                continue
+            try:
+                sock.settimeout(timeout)
+                send_frame(sock, message)
+                response = recv_frame(sock)
+                if response is None:
+                    raise ConnectionError("daemon closed the connection")
+            except (OSError, ValueError) as e:
+                sock.close()
+                self.restarts += 1
+                error = e
+                continue
+            self._release(sock)
+            if not response.get('ok'):
+                raise EngineError(response.get('error', 'engine daemon error'))
+            return response
+        raise EngineError(f"engine daemon request failed: {error}")
+    
+    def get_best_move(self, board: chess.Board) -> Optional[chess.Move]:
+        start = time.monotonic()
+        response = self._request({
+            'op': 'bestmove',
+            'fen': board.root().fen(),
+            'moves': [move.uci() for move in board.move_stack],
+            'depth': self.depth,
+            'movetime': self.time_limit
+        }, self.time_limit + 2 * self.timeout)  # Allow for waiting on a busy daemon
+        self.latencies.append(time.monotonic() - start)
+        move = response.get('move')
+        return chess.Move.from_uci(move) if move else None
+    
+    def ping(self) -> bool:
+        try:
+            self._request({'op': 'ping'}, self.timeout)
+            return True
+        except EngineError:
+            return False
+    
+    def stats(self) -> dict:
+        return latency_stats(self.latencies, self.restarts)
+    
+    def configure(self, depth: int, time_limit: float, timeout: float):
+        self.depth = depth
+        self.time_limit = time_limit
+        self.timeout = timeout
+    
+    def close(self):
+        """Close idle connections; the daemon and its engines keep running"""
+        with self._pools_lock:
+            for sock in self._pools.pop(self.address, []):
+                sock.close()
+
+def engine_daemon_main(argv: Optional[List[str]] = None):
+    """Command-line entry point: run a shared engine daemon"""
+    config = Config()
+    parser = argparse.ArgumentParser(
+        prog='chess-engined',
+        description='Serve warm Stockfish engines to chess UIs on this host'
+    )
+    parser.add_argument('-l', '--listen', default=config.engine_daemon or str(ENGINE_SOCKET),
+                        help="Unix socket path or host:port (default: %(default)s)")
+    parser.add_argument('-n', '--engines', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='number of engine processes (default: %(default)s)')
+    parser.add_argument('--stockfish', default=config.stockfish_path,
+                        help='engine binary (default: %(default)s)')
+    parser.add_argument('-o', '--option', action='append', default=[], metavar='NAME=VALUE',
+                        help='UCI option for every engine, e.g. Hash=256')
+    args = parser.parse_args(argv)
+    
+    # Calibrated options from config.json, overridden per option on the command line
+    options = dict(config.engine_options)
+    options.update(option.split('=', 1) for option in args.option)
+    # Clean shutdown (socket removal, engine quit) on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    daemon = EngineDaemon(args.stockfish, args.engines, config.engine_timeout, options)
+    daemon.serve(args.listen)
+
+# Middlegame positions for calibration searches; the start position alone is too narrow
+CALIBRATION_FENS = [
+    'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4',
+    'r2q1rk1/pp2bppp/2n1pn2/3p4/3P1B2/2PBPN2/PP1N1PPP/R2QK2R w KQ - 1 9',
+    'r1b2rk1/2q1bppp/p2p1n2/np2p3/3PP3/5N1P/PPBN1PP1/R1BQR1K1 b - - 0 13',
+    '2rq1rk1/pp1bppbp/3p1np1/4n3/3NP3/1BN1BP2/PPPQ2PP/2KR3R w - - 5 12',
+]
+
+# Strength presets: target depth per level; the time budget is measured
+STRENGTH_DEPTHS = {'easy': 2, 'medium': 8, 'strong': 14}
+
+def available_memory_mb() -> Optional[int]:
+    """MemAvailable from /proc/meminfo, None where it is not available"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def run_bench(path: str, timeout: float = 300.0) -> Optional[int]:
+    """Nodes/second from the engine's built-in 'bench' command, None if unsupported"""
+    try:
+        result = subprocess.run([path, 'bench', '16', '1', '10'], stdin=subprocess.DEVNULL, capture_output=True,
+                                text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
         return None
+    # Stockfish prints the summary on stderr
+    for line in (result.stderr + result.stdout).splitlines():
+        if line.startswith('Nodes/second'):
+            try:
+                return int(line.split(':')[1])
+            except (IndexError, ValueError):
+                return None
+    return None
+
+def measure_nps(engine: StockfishEngine, nodes: int) -> float:
+    """Engine-measured NPS of fixed-node searches over the calibration positions
+
+    Uses the nodes and time of each search's final info line, so UCI round
+    trips are not counted; falls back to the mean reported nps for engines
+    that do not report the search time.
+    """
+    searches = []
+    for fen in CALIBRATION_FENS:
+        engine.new_game()
+        searches.append(engine.analyse(chess.Board(fen), f'nodes {nodes}', expected_time=60.0))
     
-    def play_sound(self, sound_name: str):
-        if self.config.play_sounds and sound_name in self.sounds:
-            self.sounds[sound_name].play()
+    if all(info.get('nodes') and info.get('time') for info in searches):
+        return sum(info['nodes'] for info in searches) / (sum(info['time'] for info in searches) / 1000)
+    reported = [info['nps'] for info in searches if info.get('nps')]
+    return sum(reported) / len(reported) if reported else 0.0
 
-class ChessUI:
-    def __init__(self, config: Config):
-        self.config = config
-        
-        # Initialize board with starting FEN from config
-        self.board = chess.Board(config.starting_fen)
-        
-        # Initialize pygame first
-        pygame.init()
-        pygame.mixer.init()
+def calibrate(path: str, engines: int = 1, nodes: int = 1_000_000, memory_fraction: float = 0.25,
+              min_efficiency: float = 0.6, verbose: bool = True) -> dict:
+    """Benchmark this host and pick engine options and strength presets
+
+    Threads is the largest count whose NPS scales with at least `min_efficiency`
+    per thread. Hash is the largest power of two within `memory_fraction` of free
+    memory (shared by `engines` processes) that still allocates promptly.
+    """
+    def log(message):
+        if verbose:
+            print(message)
+    
+    result = {'bench_nps': run_bench(path)}
+    log(f"bench: {result['bench_nps'] or 'unavailable'} nodes/s")
+    
+    engine = StockfishEngine(path, timeout=30.0, options={'Hash': 16})
+    try:
+        # Thread scaling; leave one core for the UI (or for the other daemon engines)
+        cores = max(1, (os.cpu_count() or 1) // engines - (1 if engines == 1 else 0))
+        candidates = [1]
+        while candidates[-1] * 2 <= cores:
+            candidates.append(candidates[-1] * 2)
+        if cores not in candidates:
+            candidates.append(cores)
         
-        # Now load assets (which need mixer initialized)
-        self.assets = AssetManager(config)
+        threads = 1
+        base_nps = None
+        scaling = {}
+        for count in candidates:
+            engine.set_option('Threads', count)
+            nps = measure_nps(engine, nodes)
+            if base_nps is None:
+                base_nps = nps
+            efficiency = nps / (base_nps * count) if base_nps else 0.0
+            scaling[count] = {'nps': int(nps), 'efficiency': round(efficiency, 2)}
+            log(f"Threads={count}: {int(nps)} nodes/s, efficiency {efficiency:.2f}")
+            if efficiency < min_efficiency:
+                break
+            threads = count
+        result['scaling'] = scaling
+        engine.set_option('Threads', threads)
         
-        # Initialize engine
-        self.engine = StockfishEngine(
-            config.stockfish_path,
-            config.stockfish_depth,
-            config.stockfish_time
-        )
+        # Hash size: memory budget, then allocation time as a pressure check
+        available = available_memory_mb()
+        budget = int(available * memory_fraction / engines) if available else 256
+        log(f"memory: {available or 'unknown'} MB available, {budget} MB budget per engine")
+        hash_mb = 16
+        size = 16
+        while size <= budget:
+            start = time.monotonic()
+            engine.set_option('Hash', size)
+            if not engine.ping():
+                break
+            elapsed = time.monotonic() - start
+            log(f"Hash={size}: allocated in {elapsed:.3f}s")
+            if elapsed > 1.0:
+                # Swapping or overcommitted; stay at the last size that allocated quickly
+                break
+            hash_mb = size
+            size *= 2
+        engine.set_option('Hash', hash_mb)
+        engine.ping()
+        result['engine_options'] = {'Threads': threads, 'Hash': hash_mb}
         
-        self.window_size = WINDOW_SIZE
+        # Time budget per strength level with the chosen options
+        presets = {}
+        for name, depth in STRENGTH_DEPTHS.items():
+            slowest = 0.0
+            for fen in CALIBRATION_FENS:
+                start = time.monotonic()
+                engine.analyse(chess.Board(fen), f'depth {depth}', expected_time=60.0)
+                slowest = max(slowest, time.monotonic() - start)
+            # Headroom so the depth is normally reached before the time limit
+            presets[name] = {'depth': depth, 'time': round(max(0.05, slowest * 1.5), 3)}
+            log(f"{name}: depth {depth} in {slowest:.3f}s")
+        result['strength_presets'] = presets
+    finally:
+        engine.close()
+    return result
+
+def calibrate_main(argv: Optional[List[str]] = None):
+    """Command-line entry point: tune engine options and strength presets for this host"""
+    config = Config()
+    parser = argparse.ArgumentParser(
+        prog='chess-calibrate',
+        description='Benchmark this host and write engine options and strength presets to config.json'
+    )
+    parser.add_argument('--stockfish', default=config.stockfish_path,
+                        help='engine binary (default: %(default)s)')
+    parser.add_argument('-n', '--engines', type=int, default=1,
+                        help='engine processes sharing this host, e.g. chess-engined -n (default: %(default)s)')
+    parser.add_argument('--nodes', type=int, default=1_000_000,
+                        help='nodes per scaling search (default: %(default)s)')
+    parser.add_argument('--memory-fraction', type=float, default=0.25,
+                        help='share of available memory for Hash (default: %(default)s)')
+    parser.add_argument('--strength', choices=list(STRENGTH_DEPTHS),
+                        help='also play at this preset instead of stockfish_depth/stockfish_time')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the result without changing config.json')
+    args = parser.parse_args(argv)
+    
+    try:
+        result = calibrate(args.stockfish, max(1, args.engines), args.nodes, args.memory_fraction)
+    except (OSError, EngineError) as e:
+        sys.exit(f"Calibration failed: {e}")
+    
+    print(json.dumps({key: result[key] for key in ('engine_options', 'strength_presets')}, indent=2))
+    if args.dry_run:
+        return
+    
+    # Merge into the existing file so other settings are kept
+    try:
+        with open(config.config_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = config.get_defaults()
+    data['engine_options'] = result['engine_options']
+    data['strength_presets'] = result['strength_presets']
+    # The difficulty only changes when asked for
+    if args.strength:
+        data['strength'] = args.strength
+    config.save(data)
+    print(f"Wrote {config.config_path}")
+
+# Centipawn loss of the mover that makes a move an inaccuracy / mistake / blunder
+MOVE_GLYPHS = [(300, '??'), (100, '?'), (50, '?!')]
+
+@dataclass
+class AnalysisResult:
+    """Engine verdict on one position, from White's point of view"""
+    score: Optional[int]  # Centipawns
+    mate: Optional[int]  # Moves to mate; positive = White mates
+    best_move: Optional[chess.Move]
+    depth: int
+    
+    @classmethod
+    def from_info(cls, info: dict, turn: chess.Color) -> 'AnalysisResult':
+        sign = 1 if turn == chess.WHITE else -1
+        score = info.get('score')
+        mate = info.get('mate')
+        return cls(
+            score=None if score is None else score * sign,
+            mate=None if mate is None else mate * sign,
+            best_move=info.get('move'),
+            depth=info.get('depth', 0)
+        )
+    
+    def value(self, limit: int = 1000) -> int:
+        """Centipawns clamped to +-limit, mates at the limit"""
+        if self.mate is not None:
+            return limit if self.mate > 0 else -limit
+        return max(-limit, min(limit, self.score or 0))
+    
+    def format(self) -> str:
+        if self.mate is not None:
+            return f"#{self.mate}"
+        return f"{(self.score or 0) / 100:+.2f}"
+
+def classify_move(before: AnalysisResult, after: AnalysisResult, mover: chess.Color) -> str:
+    """Annotation glyph ('??', '?', '?!' or '') from the evaluation the mover gave away"""
+    loss = before.value() - after.value()
+    if mover == chess.BLACK:
+        loss = -loss
+    for threshold, glyph in MOVE_GLYPHS:
+        if loss >= threshold:
+            return glyph
+    return ''
+
+class GameAnalyzer:
+    """Analyze game positions in the background with a separate, low-priority engine
+
+    Results are cached by position hash, so undone, replayed or transposed
+    positions are not searched again. pause() stops the current search at
+    once; the interrupted position is searched again after resume().
+    """
+    
+    def __init__(self, path: str, depth: int = 12, threads: int = 1, timeout: float = 5.0,
+                 on_result=None):
+        self.depth = depth
+        # Lowest CPU priority so the game's own engine and the UI always win
+        self.engine = StockfishEngine(path, timeout=timeout, options={'Threads': threads}, niceness=19)
+        self.on_result = on_result
         
-        # Create resizable window - can be rectangular
-        self.window_width = self.window_size
-        self.window_height = self.window_size
-        self.screen = pygame.display.set_mode(
-            (self.window_width, self.window_height),
-            pygame.RESIZABLE
+        self.results = {}
+        # (position hash, FEN) in game order
+        self.positions: List[Tuple[int, str]] = []
+        self.current = None
+        self.paused = False
+        self.closed = False
+        self.wake = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True, name='analysis')
+        self.thread.start()
+    
+    def set_positions(self, positions: List[Tuple[int, str]]):
+        with self.wake:
+            self.positions = positions
+            self.wake.notify()
+    
+    def pause(self):
+        with self.wake:
+            self.paused = True
+            if self.current is not None:
+                self.engine.stop()
+    
+    def resume(self):
+        with self.wake:
+            self.paused = False
+            self.wake.notify()
+    
+    def _next_position(self) -> Optional[Tuple[int, str]]:
+        # Newest first: the move just played matters most
+        for key, fen in reversed(self.positions):
+            if key not in self.results:
+                return key, fen
+        return None
+    
+    def _run(self):
+        while True:
+            with self.wake:
+                job = None
+                while not self.closed and (self.paused or job is None):
+                    job = None if self.paused else self._next_position()
+                    if job is None:
+                        self.wake.wait()
+                if self.closed:
+                    return
+                key, fen = job
+                self.current = key
+                self.engine.stop_requested = False
+            
+            board = chess.Board(fen)
+            try:
+                info = self.engine.analyse(board, f'depth {self.depth}', expected_time=30.0)
+            except EngineError as e:
+                print(f"Analysis stopped: {e}")
+                return
+            
+            with self.wake:
+                self.current = None
+                if self.engine.stop_requested or self.closed:
+                    # Cut short by pause() or close(); search again later
+                    continue
+                self.results[key] = AnalysisResult.from_info(info, board.turn)
+            if self.on_result:
+                self.on_result(key)
+    
+    def close(self):
+        with self.wake:
+            self.closed = True
+            if self.current is not None:
+                self.engine.stop()
+            self.wake.notify()
+        self.thread.join(timeout=2.0)
+        self.engine.close()
+
+@dataclass
+class GameStatus:
+    """Rule state of one position, evaluated once when the ply is played"""
+    check: bool
+    checkmate: bool
+    stalemate: bool
+    insufficient_material: bool
+    halfmove_clock: int
+    repetitions: int  # Occurrences of this position so far, including now
+    
+    @property
+    def game_over(self) -> bool:
+        """Same as Board.is_game_over(): only automatic endings, no claims"""
+        return (self.checkmate or self.stalemate or self.insufficient_material
+                or self.halfmove_clock >= 150 or self.repetitions >= 5)
+    
+    @property
+    def can_claim_draw(self) -> bool:
+        """Fifty-move rule or threefold repetition"""
+        return self.halfmove_clock >= 100 or self.repetitions >= 3
+    
+    def result(self, turn: chess.Color) -> str:
+        if self.checkmate:
+            return '0-1' if turn == chess.WHITE else '1-0'
+        return '1/2-1/2' if self.game_over else '*'
+
+class StatusTracker:
+    """GameStatus per ply plus a Zobrist-keyed occurrence table for repetitions
+
+    push()/pop() follow Board.push()/pop(), so the cost per ply does not grow
+    with the length of the game.
+    """
+    
+    def __init__(self, board: chess.Board):
+        self.rebuild(board)
+    
+    def rebuild(self, board: chess.Board):
+        """Recount from the board's root, e.g. after a reset or a swapped-in board"""
+        self.occurrences = {}
+        self.stack: List[Tuple[int, GameStatus]] = []
+        replay = board.root()
+        self.push(replay)
+        for move in board.move_stack:
+            replay.push(move)
+            self.push(replay)
+    
+    def push(self, board: chess.Board) -> GameStatus:
+        """Record the position just reached on the board"""
+        key = chess.polyglot.zobrist_hash(board)
+        self.occurrences[key] = self.occurrences.get(key, 0) + 1
+        check = board.is_check()
+        has_moves = any(board.generate_legal_moves())
+        status = GameStatus(
+            check=check,
+            checkmate=check and not has_moves,
+            stalemate=not check and not has_moves,
+            insufficient_material=board.is_insufficient_material(),
+            halfmove_clock=board.halfmove_clock,
+            repetitions=self.occurrences[key],
         )
-        pygame.display.set_caption('Offline Chess')
+        self.stack.append((key, status))
+        return status
+    
+    def pop(self):
+        """Forget the last position after Board.pop()"""
+        key, _ = self.stack.pop()
+        self.occurrences[key] -= 1
+        if not self.occurrences[key]:
+            del self.occurrences[key]
+    
+    @property
+    def status(self) -> GameStatus:
+        return self.stack[-1][1]
+
+class ChessGame:
+    """Headless game state and rules, shared by ChessUI and GameServer"""
+    
+    def __init__(self, starting_fen: str = chess.STARTING_FEN, player_color: chess.Color = chess.WHITE,
+                 record_notation: bool = True):
+        self.starting_fen = starting_fen
+        self.board = chess.Board(starting_fen)
+        self.player_color = player_color
+        # Servers skip per-ply notation records to keep games small
+        self.record_notation = record_notation
         
-        self.clock = pygame.time.Clock()
+        # Move history for undo
+        self.move_history: List[chess.Move] = []
+        # Memoized notation of every ply on the board
+        self.notation_plies: List[PlyNotation] = []
+        # Check/mate/draw state, updated once per ply
+        self.tracker = StatusTracker(self.board)
+    
+    @property
+    def status(self) -> GameStatus:
+        return self.tracker.status
+    
+    def set_board(self, board: chess.Board):
+        """Adopt a board positioned elsewhere (e.g. a replay seek)"""
+        self.board = board
+        self.tracker.rebuild(board)
+    
+    def find_move(self, from_sq: int, to_sq: int) -> Optional[chess.Move]:
+        """Legal move between two squares; promotions prefer the queen"""
+        move = chess.Move(from_sq, to_sq)
+        if move in self.board.legal_moves:
+            return move
+        for promo in [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT]:
+            promo_move = chess.Move(from_sq, to_sq, promotion=promo)
+            if promo_move in self.board.legal_moves:
+                return promo_move
+        return None
+    
+    def make_move(self, move: chess.Move, record_history: bool = True) -> Optional[PlyNotation]:
+        """Push a legal move; returns its notation record when recording notation"""
+        ply = PlyNotation.from_board(move, self.board) if self.record_notation else None
+        if record_history:
+            self.move_history.append(move)
+        if ply:
+            self.notation_plies.append(ply)
+        self.board.push(move)
+        self.tracker.push(self.board)
+        return ply
+    
+    def undo_ply(self) -> chess.Move:
+        """Take back a single ply"""
+        move = self.board.pop()
+        self.tracker.pop()
+        if self.move_history:
+            self.move_history.pop()
+        if self.notation_plies:
+            self.notation_plies.pop()
+        return move
+    
+    def can_undo(self) -> bool:
+        return len(self.move_history) >= 2
+    
+    def undo(self) -> List[chess.Move]:
+        """Take back the last engine + player move pair (most recent first)"""
+        if not self.can_undo():
+            return []
+        return [self.undo_ply(), self.undo_ply()]
+    
+    def reset(self, starting_fen: Optional[str] = None):
+        if starting_fen:
+            self.starting_fen = starting_fen
+        self.board.set_fen(self.starting_fen)
+        self.tracker.rebuild(self.board)
+        self.move_history.clear()
+        self.notation_plies.clear()
+    
+    def switch_sides(self, starting_fen: Optional[str] = None):
+        """Play the other color; switching sides restarts the game"""
+        self.player_color = not self.player_color
+        self.reset(starting_fen)
+    
+    def is_engine_turn(self) -> bool:
+        return not self.status.game_over and self.board.turn != self.player_color
+    
+    def describe(self) -> dict:
+        """Compact JSON-friendly summary of the position"""
+        return {
+            'fen': self.board.fen(),
+            'turn': 'white' if self.board.turn == chess.WHITE else 'black',
+            'player': 'white' if self.player_color == chess.WHITE else 'black',
+            'ply': len(self.board.move_stack),
+            'result': self.status.result(self.board.turn)
+        }
+
+class GameReplay:
+    """Random access over a finished game's mainline
+
+    Boards are checkpointed every `interval` plies on load. A seek steps with
+    push/pop when the target is near, otherwise it copies the closest
+    checkpoint and pushes at most interval - 1 moves, so the cost does not
+    grow with game length.
+    """
+    
+    def __init__(self, starting_fen: str, moves: List[chess.Move], interval: int = 16):
+        self.moves = list(moves)
+        self.interval = interval
         
-        # Selection and move indicators - use circle_color from config
-        self.selected_color = tuple(list(config.circle_color) + [128])  # Semi-transparent green
-        self.legal_move_color = config.circle_color
+        board = chess.Board(starting_fen)
+        self.checkpoints = [board.copy(stack=False)]
+        for i, move in enumerate(self.moves, 1):
+            board.push(move)
+            if i % interval == 0:
+                self.checkpoints.append(board.copy(stack=False))
         
-        # Calculate lighter capture indicator color (30% lighter)
-        self.capture_color = tuple(min(255, int(c * 1.3)) for c in config.circle_color)
+        self.board = self.checkpoints[0].copy(stack=False)
+        self.ply = 0
+    
+    @classmethod
+    def from_pgn(cls, stream, index: int = 0, interval: int = 16) -> Optional['GameReplay']:
+        """Load the index-th game of a PGN stream"""
+        for _ in range(index):
+            if not chess.pgn.skip_game(stream):
+                return None
+        game = chess.pgn.read_game(stream)
+        if game is None:
+            return None
+        return cls(game.board().fen(), list(game.mainline_moves()), interval)
+    
+    def __len__(self) -> int:
+        return len(self.moves)
+    
+    def seek(self, target: int) -> chess.Board:
+        target = max(0, min(target, len(self.moves)))
+        checkpoint = target // self.interval
         
-        # Input state
-        self.selected_square = None
-        self.dragging_piece = None
-        self.dragging_from_square = None
-        self.drag_pos = None
-        self.input_mode = InputMode.NONE
+        if self.ply <= target and self.ply >= checkpoint * self.interval:
+            # Forward within reach of the current board
+            pass
+        elif target < self.ply and self.ply - target <= len(self.board.move_stack):
+            while self.ply > target:
+                self.board.pop()
+                self.ply -= 1
+            return self.board
+        else:
+            self.board = self.checkpoints[checkpoint].copy(stack=False)
+            self.ply = checkpoint * self.interval
         
-        # Arrow drawing state
-        self.arrow_start = None
+        while self.ply < target:
+            self.board.push(self.moves[self.ply])
+            self.ply += 1
+        return self.board
+    
+    def last_move(self) -> Optional[chess.Move]:
+        return self.moves[self.ply - 1] if self.ply else None
+
+class GameServer:
+    """Hosts many headless games over a local socket with asyncio"""
+    
+    def __init__(self, engines: list, game_ttl: float = 3600.0):
+        self.games = {}
+        self.last_active = {}
+        self.searching = set()  # Game ids with an engine search in flight
+        self.game_ttl = game_ttl
         
-        # Markers and arrows
-        self.arrows: List[Arrow] = []
-        self.markers: List[Marker] = []
+        # Engine searches block, so they run on threads; one per engine
+        self.engines = engines
+        self.idle_engines = None
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(engines)))
+    
+    def _game(self, request: dict) -> ChessGame:
+        game_id = request.get('game')
+        if game_id not in self.games:
+            raise KeyError(f"unknown game {game_id!r}")
+        self.last_active[game_id] = time.monotonic()
+        return self.games[game_id]
+    
+    async def search(self, game: ChessGame) -> Optional[chess.Move]:
+        if not self.engines:
+            raise EngineError("no engine available")
+        engine = await self.idle_engines.get()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, engine.get_best_move, game.board.copy())
+        finally:
+            self.idle_engines.put_nowait(engine)
+    
+    async def handle_request(self, request: dict) -> dict:
+        op = request.get('op')
+        if op == 'new':
+            color = chess.BLACK if request.get('color') == 'black' else chess.WHITE
+            game = ChessGame(request.get('fen') or chess.STARTING_FEN, color, record_notation=False)
+            game_id = secrets.token_hex(8)
+            self.games[game_id] = game
+            self.last_active[game_id] = time.monotonic()
+            return {'ok': True, 'game': game_id, **game.describe()}
+        
+        game_id = request.get('game')
+        game = self._game(request)
+        if op == 'state':
+            return {'ok': True, **game.describe()}
+        if op == 'legal':
+            return {'ok': True, 'moves': [move.uci() for move in game.board.legal_moves]}
+        if op == 'bestmove':
+            move = await self.search(game)
+            return {'ok': True, 'move': move.uci() if move else None}
+        if op == 'close':
+            del self.games[game_id]
+            del self.last_active[game_id]
+            return {'ok': True}
+        
+        # Everything below changes the position
+        if game_id in self.searching:
+            return {'ok': False, 'error': 'engine is thinking'}
+        
+        if op == 'move':
+            move = chess.Move.from_uci(request['move'])
+            if move not in game.board.legal_moves:
+                return {'ok': False, 'error': f"illegal move {request['move']}"}
+            san = game.board.san(move)
+            game.make_move(move)
+            response = {'ok': True, 'san': san}
+            
+            # Optionally answer with the engine move in the same round trip
+            if request.get('reply') and game.is_engine_turn():
+                self.searching.add(game_id)
+                try:
+                    reply = await self.search(game)
+                finally:
+                    self.searching.discard(game_id)
+                if reply and game_id in self.games:
+                    response['reply'] = reply.uci()
+                    response['reply_san'] = game.board.san(reply)
+                    game.make_move(reply)
+            response.update(game.describe())
+            return response
+        if op == 'undo':
+            plies = int(request.get('plies', 2))
+            if len(game.board.move_stack) < plies:
+                return {'ok': False, 'error': 'nothing to undo'}
+            undone = [game.undo_ply().uci() for _ in range(plies)]
+            return {'ok': True, 'undone': undone, **game.describe()}
+        if op == 'reset':
+            game.reset(request.get('fen'))
+            return {'ok': True, **game.describe()}
+        if op == 'switch':
+            game.switch_sides(request.get('fen'))
+            return {'ok': True, **game.describe()}
+        return {'ok': False, 'error': f"unknown op {op!r}"}
+    
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                try:
+                    response = await self.handle_request(request)
+                except (KeyError, ValueError, TypeError, EngineError) as e:
+                    response = {'ok': False, 'error': str(e)}
+                await write_frame(writer, response)
+        except (ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutting down with the client still connected
+            pass
+        finally:
+            writer.close()
+    
+    async def reap_idle_games(self):
+        """Drop games nobody touched for game_ttl seconds"""
+        while True:
+            await asyncio.sleep(min(60.0, self.game_ttl))
+            cutoff = time.monotonic() - self.game_ttl
+            for game_id in [gid for gid, last in self.last_active.items() if last < cutoff]:
+                if game_id not in self.searching:
+                    del self.games[game_id]
+                    del self.last_active[game_id]
+    
+    async def serve(self, address: str):
+        self.idle_engines = asyncio.Queue()
+        for engine in self.engines:
+            self.idle_engines.put_nowait(engine)
+        
+        family, bind_address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(bind_address):
+                os.unlink(bind_address)
+            server = await asyncio.start_unix_server(self.handle_connection, bind_address, backlog=1024)
+        else:
+            server = await asyncio.start_server(self.handle_connection, *bind_address, backlog=1024)
+        
+        print(f"Game server: {len(self.engines)} engines on {address}")
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        reaper = asyncio.create_task(self.reap_idle_games())
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            reaper.cancel()
+            if family == socket.AF_UNIX and os.path.exists(bind_address):
+                os.unlink(bind_address)
+    
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for engine in self.engines:
+            engine.close()
+
+def game_server_main(argv: Optional[List[str]] = None):
+    """Command-line entry point: run a headless game server"""
+    config = Config()
+    parser = argparse.ArgumentParser(
+        prog='chess-server',
+        description='Host many headless chess games over a local socket'
+    )
+    parser.add_argument('-l', '--listen', default=config.game_server or str(GAME_SOCKET),
+                        help="Unix socket path or host:port (default: %(default)s)")
+    parser.add_argument('-n', '--engines', type=int, default=1,
+                        help='engines searching in parallel (default: %(default)s)')
+    parser.add_argument('--game-ttl', type=float, default=3600.0,
+                        help='seconds before an idle game is dropped (default: %(default)s)')
+    args = parser.parse_args(argv)
+    
+    engines = []
+    for _ in range(args.engines):
+        try:
+            if config.engine_daemon:
+                engines.append(EngineClient(config.engine_daemon, config.stockfish_depth,
+                                            config.stockfish_time, config.engine_timeout))
+            else:
+                engines.append(StockfishEngine(config.stockfish_path, config.stockfish_depth,
+                                               config.stockfish_time, config.engine_timeout,
+                                               config.engine_options))
+        except (OSError, EngineError) as e:
+            print(f"Stockfish unavailable ({e}), serving games without engine")
+            break
+    
+    server = GameServer(engines, args.game_ttl)
+    try:
+        asyncio.run(server.serve(args.listen))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+class GameServerError(Exception):
+    """Game server unreachable or the connection to it failed"""
+
+class GameServerRejected(GameServerError):
+    """Game server answered a request with an error; the connection is fine"""
+
+class GameServerConnection:
+    """Blocking, thread-safe request/response connection to a GameServer"""
+    
+    def __init__(self, address: str, timeout: float = 30.0):
+        self.address = address
+        family, connect_address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(connect_address)
+        except OSError as e:
+            self.sock.close()
+            raise GameServerError(f"game server not reachable at {address}: {e}")
+        self.lock = threading.Lock()
+    
+    def request(self, op: str, **fields) -> dict:
+        with self.lock:
+            try:
+                send_frame(self.sock, {'op': op, **fields})
+                response = recv_frame(self.sock)
+            except (OSError, ValueError) as e:
+                raise GameServerError(f"game server connection failed: {e}")
+        if response is None:
+            raise GameServerError("game server closed the connection")
+        if not response.get('ok'):
+            raise GameServerRejected(response.get('error', 'game server error'))
+        return response
+    
+    def close(self):
+        self.sock.close()
+
+class RemoteGame(ChessGame):
+    """ChessGame mirrored on a GameServer; ChessUI renders the local copy"""
+    
+    def __init__(self, connection: GameServerConnection, starting_fen: str = chess.STARTING_FEN,
+                 player_color: chess.Color = chess.WHITE):
+        super().__init__(starting_fen, player_color)
+        self.connection = connection
+        # Searches run on their own connection so undo/reset/switch are not
+        # queued behind a search the server is still running
+        self.search_connection: Optional[GameServerConnection] = None
+        response = connection.request('new', fen=starting_fen,
+                                      color='white' if player_color == chess.WHITE else 'black')
+        self.game_id = response['game']
+    
+    def _sync(self, op: str, **fields) -> Optional[dict]:
+        """Apply a change on the server first; GameServerRejected leaves both copies unchanged"""
+        if self.connection is None:
+            return None
+        try:
+            return self.connection.request(op, game=self.game_id, **fields)
+        except GameServerRejected:
+            raise
+        except GameServerError as e:
+            # Keep the game going locally rather than losing it
+            print(f"{e}, continuing offline")
+            self.connection.close()
+            self.connection = None
+            return None
+    
+    def make_move(self, move: chess.Move, record_history: bool = True) -> Optional[PlyNotation]:
+        self._sync('move', move=move.uci())
+        return super().make_move(move, record_history)
+    
+    def undo_ply(self) -> chess.Move:
+        self._sync('undo', plies=1)
+        return super().undo_ply()
+    
+    def reset(self, starting_fen: Optional[str] = None):
+        self._sync('reset', fen=starting_fen)
+        super().reset(starting_fen)
+    
+    def switch_sides(self, starting_fen: Optional[str] = None):
+        self._sync('switch', fen=starting_fen)
+        # Base class reset, the server already reset its copy
+        self.player_color = not self.player_color
+        ChessGame.reset(self, starting_fen)
+    
+    def get_best_move(self, board: chess.Board) -> Optional[chess.Move]:
+        """Engine search for the server-side position"""
+        if self.connection is None:
+            raise EngineError("game server offline")
+        try:
+            if self.search_connection is None:
+                self.search_connection = GameServerConnection(self.connection.address)
+            response = self.search_connection.request('bestmove', game=self.game_id)
+        except GameServerError as e:
+            raise EngineError(str(e))
+        move = response.get('move')
+        return chess.Move.from_uci(move) if move else None
+
+class ServerEngine:
+    """Engine interface for ChessUI backed by a RemoteGame's server"""
+    
+    def __init__(self, game: RemoteGame):
+        self.game = game
+        self.latencies = deque(maxlen=1000)
+    
+    def get_best_move(self, board: chess.Board) -> Optional[chess.Move]:
+        start = time.monotonic()
+        move = self.game.get_best_move(board)
+        self.latencies.append(time.monotonic() - start)
+        return move
+    
+    def stats(self) -> dict:
+        return latency_stats(self.latencies, 0)
+    
+    def configure(self, depth: int, time_limit: float, timeout: float):
+        """Search limits are owned by the server"""
+    
+    def close(self):
+        if self.game.search_connection:
+            self.game.search_connection.close()
+            self.game.search_connection = None
+        if self.game.connection:
+            try:
+                self.game._sync('close')
+            except GameServerRejected:
+                pass  # Already dropped by the server, e.g. after game_ttl
+            if self.game.connection:
+                self.game.connection.close()
+            self.game.connection = None
+
+class Broadcaster:
+    """Publishes a live game to spectators as compact move deltas
+
+    Runs its own asyncio loop on a background thread; the publish_* methods
+    are thread-safe and never block the caller. Each subscriber has a
+    bounded queue: a subscriber that falls behind is resynced with a fresh
+    snapshot instead of holding up the game.
+
+    Messages (length-prefixed JSON frames, see encode_frame):
+      {"t": "s", "n": ply, "fen": fen, "m": [uci, ...]}  snapshot: position + recent moves
+      {"t": "m", "n": ply, "u": uci, "c": ms, "e": cp}    move ("e" only with an eval)
+      {"t": "u", "n": ply}                                 last move taken back
+    """
+    
+    def __init__(self, address: str, starting_fen: str = chess.STARTING_FEN,
+                 queue_size: int = 64, history: int = 32):
+        self.address = address
+        self.queue_size = queue_size
+        self.board = chess.Board(starting_fen)
+        # (FEN before the move, uci) for the last moves replayed to late joiners
+        self.recent = deque(maxlen=history)
+        self.started = time.monotonic()
+        self.clients = set()
+        
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+        self._ready = threading.Event()
+        self._error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+    
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            family, bind_address = parse_address(self.address)
+            if family == socket.AF_UNIX:
+                if os.path.exists(bind_address):
+                    os.unlink(bind_address)
+                start = asyncio.start_unix_server(self._handle, bind_address, backlog=1024)
+            else:
+                start = asyncio.start_server(self._handle, *bind_address, backlog=1024)
+            self.server = self.loop.run_until_complete(start)
+        except OSError as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        self.loop.run_forever()
+    
+    def _snapshot(self) -> bytes:
+        fen = self.recent[0][0] if self.recent else self.board.fen()
+        return encode_frame({
+            't': 's',
+            'n': len(self.board.move_stack),
+            'fen': fen,
+            'm': [uci for _, uci in self.recent]
+        })
+    
+    def _fan_out(self, frame: bytes):
+        for client in self.clients:
+            if client.full():
+                # Lagging viewer: drop its backlog and resync from a snapshot
+                while not client.empty():
+                    client.get_nowait()
+                client.put_nowait(self._snapshot())
+            else:
+                client.put_nowait(frame)
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = asyncio.Queue(self.queue_size)
+        client.put_nowait(self._snapshot())
+        self.clients.add(client)
+        try:
+            while True:
+                frame = await client.get()
+                writer.write(frame)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+    
+    def _move(self, move: chess.Move, eval_cp: Optional[int]):
+        self.recent.append((self.board.fen(), move.uci()))
+        self.board.push(move)
+        message = {
+            't': 'm',
+            'n': len(self.board.move_stack),
+            'u': move.uci(),
+            'c': int((time.monotonic() - self.started) * 1000)
+        }
+        if eval_cp is not None:
+            message['e'] = eval_cp
+        self._fan_out(encode_frame(message))
+    
+    def _undo(self):
+        if not self.board.move_stack:
+            return
+        self.board.pop()
+        if self.recent:
+            self.recent.pop()
+            self._fan_out(encode_frame({'t': 'u', 'n': len(self.board.move_stack)}))
+        else:
+            # Spectators may not have this move; send the new position instead
+            self._fan_out(self._snapshot())
+    
+    def _reset(self, fen: str):
+        self.board.set_fen(fen)
+        self.recent.clear()
+        self._fan_out(self._snapshot())
+    
+    def publish_move(self, move: chess.Move, eval_cp: Optional[int] = None):
+        self.loop.call_soon_threadsafe(self._move, move, eval_cp)
+    
+    def publish_undo(self):
+        self.loop.call_soon_threadsafe(self._undo)
+    
+    def publish_reset(self, fen: str):
+        self.loop.call_soon_threadsafe(self._reset, fen)
+    
+    async def _shutdown(self):
+        self.server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+    
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        self.thread.join(timeout=1.0)
+        family, bind_address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+
+class SpectatorFeed:
+    """Reads a Broadcaster stream on a thread and posts each message as BROADCAST_EVENT"""
+    
+    def __init__(self, address: str):
+        family, connect_address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(connect_address)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        try:
+            while True:
+                message = recv_frame(self.sock)
+                if message is None:
+                    break
+                pygame.event.post(pygame.event.Event(BROADCAST_EVENT, message=message))
+        except (OSError, ValueError):
+            pass
+        # None tells the UI the broadcast is over
+        pygame.event.post(pygame.event.Event(BROADCAST_EVENT, message=None))
+    
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+@dataclass
+class Puzzle:
+    puzzle_id: str
+    fen: str
+    moves: List[str]  # UCI; moves[0] is the opponent move that sets up the puzzle
+    rating: int
+    themes: List[str]
+
+class PuzzleStore:
+    """SQLite puzzle database indexed by rating and theme"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS puzzles (
+            id INTEGER PRIMARY KEY,
+            puzzle_id TEXT NOT NULL UNIQUE,
+            fen TEXT NOT NULL,
+            moves TEXT NOT NULL,
+            rating INTEGER NOT NULL,
+            themes TEXT NOT NULL,
+            rkey INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS puzzle_themes (
+            theme TEXT NOT NULL,
+            rating INTEGER NOT NULL,
+            puzzle INTEGER NOT NULL,
+            rkey INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (theme, rating, puzzle)
+        ) WITHOUT ROWID;
+    """
+    # rkey is a random number fixed at import; seeking to a random rkey
+    # within a rating picks uniformly among that rating's puzzles
+    INDEXES = """
+        DROP INDEX IF EXISTS puzzles_rating;
+        CREATE INDEX IF NOT EXISTS puzzles_rating_rkey ON puzzles (rating, rkey);
+        CREATE INDEX IF NOT EXISTS puzzle_themes_rkey ON puzzle_themes (theme, rating, rkey);
+    """
+    RKEY_BITS = 62
+    
+    def __init__(self, path: str = str(PUZZLE_DB)):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(self.SCHEMA)
+        self._add_random_keys()
+        self.conn.executescript(self.INDEXES)
+        # (rating_min, rating_max, theme) -> (ratings, cumulative puzzle counts)
+        self.buckets = {}
+    
+    def _add_random_keys(self):
+        """Give databases imported before rkey existed their random keys (once)"""
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(puzzle_themes)')]
+        if 'rkey' in columns:
+            return
+        with self.conn:
+            self.conn.execute('ALTER TABLE puzzles ADD COLUMN rkey INTEGER NOT NULL DEFAULT 0')
+            self.conn.execute('ALTER TABLE puzzle_themes ADD COLUMN rkey INTEGER NOT NULL DEFAULT 0')
+            self.conn.execute(f'UPDATE puzzles SET rkey = random() & {(1 << self.RKEY_BITS) - 1}')
+            self.conn.execute('UPDATE puzzle_themes SET rkey = (SELECT rkey FROM puzzles WHERE id = puzzle)')
+    
+    def import_csv(self, stream, batch_size: int = 10000) -> Tuple[int, int]:
+        """Stream a Lichess-style puzzle CSV into the database in batches
+
+        Columns: PuzzleId, FEN, Moves, Rating, ..., Themes (header optional).
+        Rows with missing columns or a non-numeric rating are skipped.
+        Returns the number of rows imported and skipped.
+        """
+        reader = csv.reader(stream)
+        columns = {'id': 0, 'fen': 1, 'moves': 2, 'rating': 3, 'themes': 7}
+        
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        count = 0
+        skipped = 0
+        batch = []
+        for row in reader:
+            if not row:
+                continue
+            if row[0] == 'PuzzleId':
+                # Header: map the columns we need by name
+                columns = {
+                    'id': row.index('PuzzleId'), 'fen': row.index('FEN'), 'moves': row.index('Moves'),
+                    'rating': row.index('Rating'), 'themes': row.index('Themes')
+                }
+                continue
+            themes = row[columns['themes']] if len(row) > columns['themes'] else ''
+            try:
+                batch.append((row[columns['id']], row[columns['fen']], row[columns['moves']],
+                              int(row[columns['rating']]), themes, random.getrandbits(self.RKEY_BITS)))
+            except (IndexError, ValueError):
+                skipped += 1
+                continue
+            count += 1
+            if len(batch) >= batch_size:
+                self._insert(batch)
+                batch = []
+        if batch:
+            self._insert(batch)
+        self.conn.execute('PRAGMA synchronous = FULL')
+        self.buckets = {}
+        return count, skipped
+    
+    def _insert(self, batch: list):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO puzzles (puzzle_id, fen, moves, rating, themes, rkey) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                batch
+            )
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO puzzle_themes (theme, rating, puzzle, rkey) '
+                'SELECT ?, rating, id, rkey FROM puzzles WHERE puzzle_id = ?',
+                [(theme, row[0]) for row in batch for theme in row[4].split()]
+            )
+    
+    def count(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM puzzles').fetchone()[0]
+    
+    def _rating_buckets(self, rating_min: int, rating_max: int, theme: str) -> Tuple[list, list]:
+        """Ratings in the band with running puzzle counts; counted once per band and theme"""
+        key = (rating_min, rating_max, theme)
+        if key not in self.buckets:
+            if theme:
+                rows = self.conn.execute(
+                    'SELECT rating, COUNT(*) FROM puzzle_themes WHERE theme = ? AND rating BETWEEN ? AND ? '
+                    'GROUP BY rating ORDER BY rating', (theme, rating_min, rating_max))
+            else:
+                rows = self.conn.execute(
+                    'SELECT rating, COUNT(*) FROM puzzles WHERE rating BETWEEN ? AND ? '
+                    'GROUP BY rating ORDER BY rating', (rating_min, rating_max))
+            ratings, totals = [], []
+            total = 0
+            for rating, count in rows:
+                total += count
+                ratings.append(rating)
+                totals.append(total)
+            self.buckets[key] = (ratings, totals)
+        return self.buckets[key]
+    
+    def random(self, rating_min: int = 0, rating_max: int = 4000, theme: str = '') -> Optional[Puzzle]:
+        """Pick a puzzle in the rating band with a bisect and an index seek (O(log n))
+
+        The rating is drawn weighted by its number of puzzles, then a random
+        rkey picks among that rating's puzzles, so every puzzle in the band
+        is about equally likely however the ratings are spread.
+        """
+        ratings, totals = self._rating_buckets(rating_min, rating_max, theme)
+        if not ratings:
+            return None
+        rating = ratings[bisect.bisect_right(totals, random.randrange(totals[-1]))]
+        
+        if theme:
+            table, columns, prefix = 'puzzle_themes', 'puzzle', 'theme = ? AND '
+            args = (theme,)
+        else:
+            table, columns, prefix = 'puzzles', 'id', ''
+            args = ()
+        
+        pick_query = (f'SELECT {columns} FROM {table} WHERE {prefix}rating = ? AND rkey >= ? '
+                      'ORDER BY rkey LIMIT 1')
+        picked = self.conn.execute(pick_query, args + (rating, random.getrandbits(self.RKEY_BITS))).fetchone()
+        if picked is None:
+            # Wrap around to the rating's smallest rkey
+            picked = self.conn.execute(pick_query, args + (rating, 0)).fetchone()
+        row = self.conn.execute('SELECT puzzle_id, fen, moves, rating, themes FROM puzzles WHERE id = ?',
+                                picked).fetchone()
+        puzzle_id, fen, moves, rating, themes = row
+        return Puzzle(puzzle_id, fen, moves.split(), rating, themes.split())
+    
+    def close(self):
+        self.conn.close()
+
+class PuzzlePrefetcher:
+    """Keeps the next few random puzzles ready on a background thread"""
+    
+    def __init__(self, path: str, rating_min: int, rating_max: int, theme: str = '', depth: int = 8):
+        self.path = path
+        self.rating_min = rating_min
+        self.rating_max = rating_max
+        self.theme = theme
+        self.ready = queue.Queue(depth)
+        self.exhausted = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        # SQLite connections belong to the thread that opened them
+        store = PuzzleStore(self.path)
+        try:
+            while True:
+                puzzle = store.random(self.rating_min, self.rating_max, self.theme)
+                if puzzle is None:
+                    self.exhausted.set()
+                    return
+                self.ready.put(puzzle)
+        finally:
+            store.close()
+    
+    def next(self) -> Optional[Puzzle]:
+        while True:
+            try:
+                return self.ready.get(timeout=0.1)
+            except queue.Empty:
+                if self.exhausted.is_set() or not self.thread.is_alive():
+                    return None
+
+def open_text(path: str):
+    """Open a (possibly .gz/.bz2 compressed) text file; '-' is stdin"""
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', newline='')
+    return open(path, 'r', newline='')
+
+def puzzle_main(argv: Optional[List[str]] = None):
+    """Command-line entry point: manage the puzzle database"""
+    config = Config()
+    parser = argparse.ArgumentParser(prog='chess-puzzles', description='Manage the local puzzle database')
+    parser.add_argument('--db', default=config.puzzle_db, help='database file (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='import a Lichess puzzle CSV (.csv, .gz, .bz2 or - for stdin)')
+    import_parser.add_argument('csv')
+    import_parser.add_argument('--batch-size', type=int, default=10000)
+    commands.add_parser('count', help='print the number of stored puzzles')
+    args = parser.parse_args(argv)
+    
+    store = PuzzleStore(args.db)
+    try:
+        if args.command == 'import':
+            stream = open_text(args.csv)
+            try:
+                rows, skipped = store.import_csv(stream, args.batch_size)
+            finally:
+                if stream is not sys.stdin:
+                    stream.close()
+            print(f"Imported {rows} rows ({skipped} skipped), {store.count()} puzzles in {args.db}")
+        else:
+            print(store.count())
+    finally:
+        store.close()
+
+# Sound priorities: a cue may only interrupt channels playing a lower/equal priority
+SOUND_PRIORITIES = {
+    'end': 4,
+    'check': 3,
+    'capture': 2,
+    'promote': 2,
+    'castle': 1,
+    'move': 1,
+    'notify': 0
+}
+
+class SoundChannelPool:
+    """Reserved mixer channels shared by game sounds with priority preemption"""
+    
+    def __init__(self, size: int = 4):
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), size))
+        pygame.mixer.set_reserved(size)
+        self.channels = [pygame.mixer.Channel(i) for i in range(size)]
+        # Per channel: (priority, start time) of the last sound played on it
+        self.playing = [(0, 0.0)] * size
+    
+    def play(self, sound: pygame.mixer.Sound, priority: int) -> bool:
+        """Play without blocking; returns False if the cue was dropped"""
+        victim = None
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                victim = i
+                break
+            # Prefer interrupting the lowest priority, then the oldest sound
+            if self.playing[i][0] <= priority and (victim is None or self.playing[i] < self.playing[victim]):
+                victim = i
+        
+        if victim is None:
+            return False
+        
+        self.channels[victim].play(sound)
+        self.playing[victim] = (priority, time.monotonic())
+        return True
+
+def surface_bytes(surface: Optional[pygame.Surface]) -> int:
+    return surface.get_pitch() * surface.get_height() if surface else 0
+
+# File types loaded at runtime; SVG sources stay out of the pack
+ASSET_SUFFIXES = ('.png', '.ogg', '.mp3', '.wav')
+ASSET_PACK_MAGIC = b'CHESSPAK'
+ASSET_PACK_VERSION = 1
+# Magic, version, table of contents length
+ASSET_PACK_HEADER = struct.Struct('<8sII')
+
+class AssetDirectory:
+    """Loose asset files under a directory, addressed as 'pieces/cburnett/wK.png'"""
+    
+    def __init__(self, root: Path):
+        self.root = root
+    
+    def exists(self, name: str) -> bool:
+        return (self.root / name).is_file()
+    
+    def mtime(self, name: str) -> int:
+        return (self.root / name).stat().st_mtime_ns
+    
+    def open(self, name: str):
+        return open(self.root / name, 'rb')
+    
+    def load_image(self, name: str, min_size: Tuple[int, int]) -> pygame.Surface:
+        return pygame.image.load(str(self.root / name))
+
+class AssetPack:
+    """Assets from a single memory-mapped file built by build_asset_pack()
+
+    The table of contents maps each name to its byte range and source mtime,
+    plus optional pre-scaled RGBA variants that load without PNG decoding.
+    Pages are shared between processes mapping the same pack.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, toc_length = ASSET_PACK_HEADER.unpack_from(self.data)
+            if magic != ASSET_PACK_MAGIC or version != ASSET_PACK_VERSION:
+                raise ValueError(f"{path} is not a version {ASSET_PACK_VERSION} asset pack")
+            start = ASSET_PACK_HEADER.size
+            self.entries = json.loads(self.data[start:start + toc_length])
+            # Offsets in the table are relative to the data that follows it
+            self.base = start + toc_length
+        except (struct.error, ValueError):
+            self.data.close()
+            raise
+    
+    def exists(self, name: str) -> bool:
+        return name in self.entries
+    
+    def mtime(self, name: str) -> int:
+        return self.entries[name]['mtime']
+    
+    def _view(self, offset: int, length: int) -> memoryview:
+        offset += self.base
+        return memoryview(self.data)[offset:offset + length]
+    
+    def open(self, name: str):
+        entry = self.entries[name]
+        return io.BytesIO(self._view(entry['offset'], entry['length']))
+    
+    def load_image(self, name: str, min_size: Tuple[int, int]) -> pygame.Surface:
+        """Smallest pre-scaled variant covering min_size, else the decoded original"""
+        for width, height, offset, length in self.entries[name].get('scaled', []):
+            if width >= min_size[0] and height >= min_size[1]:
+                # Copy so no surface keeps the mapping alive
+                return pygame.image.frombuffer(self._view(offset, length), (width, height), 'RGBA').copy()
+        with self.open(name) as f:
+            return pygame.image.load(f, name)
+    
+    def close(self):
+        self.data.close()
+
+def open_assets(pack_path: str):
+    """The asset pack if it can be mapped, else the loose files next to the module"""
+    if pack_path and os.path.exists(pack_path):
+        try:
+            return AssetPack(Path(pack_path))
+        except (OSError, ValueError) as e:
+            print(f"Ignoring asset pack {pack_path} ({e})")
+    return AssetDirectory(ASSETS_DIR)
+
+def build_asset_pack(source_dir: Path, output: Path, square_sizes: List[int]) -> Tuple[int, int]:
+    """Pack every runtime asset under source_dir into one indexed file
+
+    square_sizes adds raw RGBA variants of piece and check images at those
+    square sizes, and of board images at eight times them. Returns the number
+    of files and the pack size in bytes.
+    """
+    names = sorted(path.relative_to(source_dir).as_posix() for path in source_dir.rglob('*')
+                   if path.is_file() and path.suffix.lower() in ASSET_SUFFIXES)
+    
+    # Offsets count from the end of the table of contents
+    blobs = []
+    entries = {}
+    position = 0
+    
+    def add(blob: bytes) -> Tuple[int, int]:
+        nonlocal position
+        blobs.append(blob)
+        position += len(blob)
+        return position - len(blob), len(blob)
+    
+    for name in names:
+        path = source_dir / name
+        offset, length = add(path.read_bytes())
+        entry = entries[name] = {'offset': offset, 'length': length, 'mtime': path.stat().st_mtime_ns}
+        if not name.endswith('.png') or not square_sizes:
+            continue
+        
+        image = pygame.image.load(str(path))
+        scale = BOARD_SIZE if name.startswith('boards/') else 1
+        scaled = []
+        for square_size in sorted(set(square_sizes)):
+            size = (square_size * scale, square_size * scale)
+            # Larger variants than the source add nothing over decoding it
+            if size[0] > image.get_width() or size[1] > image.get_height():
+                break
+            variant = pygame.transform.smoothscale(image, size)
+            scaled.append([size[0], size[1], *add(pygame.image.tobytes(variant, 'RGBA'))])
+        if scaled:
+            entry['scaled'] = scaled
+    
+    toc = json.dumps(entries, separators=(',', ':')).encode()
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(ASSET_PACK_HEADER.pack(ASSET_PACK_MAGIC, ASSET_PACK_VERSION, len(toc)))
+        f.write(toc)
+        for blob in blobs:
+            f.write(blob)
+    tmp_path.replace(output)
+    return len(names), output.stat().st_size
+
+class ResidentImage:
+    """An image kept only at the largest size drawn so far
+
+    The source (full resolution or the nearest packed variant) is decoded only
+    to build or grow the resident copy and dropped right after; smaller sizes
+    are scaled from the resident copy.
+    """
+    
+    def __init__(self, source, name: str):
+        self.source = source
+        self.name = name
+        self.image: Optional[pygame.Surface] = None  # Resident copy
+        self.scaled: Optional[pygame.Surface] = None  # Copy at the size last drawn
+    
+    def get(self, size: Tuple[int, int]) -> pygame.Surface:
+        if self.scaled is not None and self.scaled.get_size() == size:
+            return self.scaled
+        
+        if self.image is None or self.image.get_width() < size[0] or self.image.get_height() < size[1]:
+            # Grow to the new size but never beyond the source resolution
+            current = self.image.get_size() if self.image else (0, 0)
+            wanted = (max(size[0], current[0]), max(size[1], current[1]))
+            source = self.source.load_image(self.name, wanted)
+            target = (min(wanted[0], source.get_width()), min(wanted[1], source.get_height()))
+            self.image = source if target == source.get_size() else pygame.transform.smoothscale(source, target)
+        
+        if self.image.get_size() == size:
+            self.scaled = self.image
+        else:
+            self.scaled = pygame.transform.smoothscale(self.image, size)
+        return self.scaled
+    
+    def shrink(self):
+        """Drop the headroom above the size currently drawn"""
+        if self.scaled is not None:
+            self.image = self.scaled
+    
+    def nbytes(self) -> int:
+        if self.scaled is self.image:
+            return surface_bytes(self.image)
+        return surface_bytes(self.image) + surface_bytes(self.scaled)
+
+class AssetManager:
+    def __init__(self, config: Config, load_sounds: bool = True):
+        self.config = config
+        # One mapped pack instead of a file open per asset when it has been built
+        self.source = open_assets(config.asset_pack)
+        
+        self.pieces = {}
+        self.sounds = {}
+        self.sound_paths = {}
+        self.sound_cache_dir = CACHE_DIR / 'sounds'
+        # Headless renderers run without a mixer
+        self.sound_pool = SoundChannelPool() if load_sounds else None
+        self.board_image: Optional[ResidentImage] = None
+        self.check_image: Optional[ResidentImage] = None
+        
+        # Text sprites for piece themes without images, and the plain board fallback
+        self.fallback_pieces = {}
+        self.fallback_board = None
+        self.over_budget_reported = False
+        
+        self._load_pieces()
+        if load_sounds:
+            self._load_sounds()
+        self._load_board_theme()
+        self._load_check_indicator()
+    
+    def reload_pieces(self):
+        """Reload piece images after a piece_theme change"""
+        self.pieces = {}
+        self.fallback_pieces = {}
+        self._load_pieces()
+    
+    def reload_board_theme(self):
+        """Reload only the board image after a board_theme change"""
+        self.board_image = None
+        self._load_board_theme()
+    
+    def _load_pieces(self):
+        piece_types = ['P', 'N', 'B', 'R', 'Q', 'K']
+        colors = ['w', 'b']
+        
+        for color in colors:
+            for piece in piece_types:
+                key = f"{color}{piece}"
+                name = f"pieces/{self.config.piece_theme}/{key}.png"
+                
+                # Images are decoded on first draw, at the size they are drawn
+                if self.source.exists(name):
+                    self.pieces[key] = ResidentImage(self.source, name)
+    
+    def _load_sounds(self):
+        sound_files = {
+            'Move': 'move',
+            'Capture': 'capture',
+            'Castle': 'castle',
+            'Check': 'check',
+            'Promote': 'promote',
+            'GameEnd': 'end',
+            'GenericNotify': 'notify'
+        }
+        
+        # Only locate files here; decoding happens on first use
+        for filename, key in sound_files.items():
+            for ext in ['.ogg', '.mp3', '.wav']:
+                name = f"sounds/{filename}{ext}"
+                if self.source.exists(name):
+                    self.sound_paths.setdefault(key, []).append(name)
+    
+    def _pcm_cache_path(self, name: str) -> Optional[Path]:
+        """Cache file for decoded samples, keyed by source mtime and mixer format"""
+        mixer_format = pygame.mixer.get_init()
+        if not mixer_format:
+            return None
+        freq, size, channels = mixer_format
+        mtime = self.source.mtime(name)
+        return self.sound_cache_dir / f"{Path(name).name}.{mtime}.{freq}_{size}_{channels}.pcm"
+    
+    def _decode_sound(self, name: str) -> pygame.mixer.Sound:
+        cache_path = self._pcm_cache_path(name)
+        if cache_path and cache_path.exists():
+            return pygame.mixer.Sound(buffer=cache_path.read_bytes())
+        
+        with self.source.open(name) as f:
+            sound = pygame.mixer.Sound(file=f)
+        if cache_path:
+            try:
+                self.sound_cache_dir.mkdir(parents=True, exist_ok=True)
+                # Drop raw buffers of older versions of this file
+                for stale in self.sound_cache_dir.glob(f"{Path(name).name}.*.pcm"):
+                    stale.unlink()
+                tmp_path = cache_path.with_suffix('.tmp')
+                tmp_path.write_bytes(sound.get_raw())
+                tmp_path.replace(cache_path)
+            except OSError:
+                pass
+        return sound
+    
+    def get_sound(self, sound_name: str) -> Optional[pygame.mixer.Sound]:
+        """Decode (or load from the PCM cache) a sound the first time it is needed"""
+        if sound_name not in self.sounds:
+            self.sounds[sound_name] = None
+            for name in self.sound_paths.get(sound_name, []):
+                try:
+                    self.sounds[sound_name] = self._decode_sound(name)
+                    break
+                except:
+                    continue
+        return self.sounds[sound_name]
+    
+    def _load_board_theme(self):
+        name = f"boards/{self.config.board_theme}.png"
+        
+        if self.source.exists(name):
+            self.board_image = ResidentImage(self.source, name)
+    
+    def _load_check_indicator(self):
+        name = 'check.png'
+        
+        if self.source.exists(name):
+            self.check_image = ResidentImage(self.source, name)
+    
+    def get_piece_image(self, piece: chess.Piece, size: Tuple[int, int]) -> Optional[pygame.Surface]:
+        """Get piece image scaled to (width, height) tuple"""
+        color = 'w' if piece.color == chess.WHITE else 'b'
+        piece_type = piece.symbol().upper()
+        key = f"{color}{piece_type}"
+        
+        if key in self.pieces:
+            return self._get_resident(self.pieces[key], size)
+        
+        fallback = self.fallback_pieces.get(key)
+        if fallback is None or fallback[0] != size:
+            fallback = (size, self._render_piece_text(color, piece_type, size))
+            self.fallback_pieces[key] = fallback
+        return fallback[1]
+    
+    def _render_piece_text(self, color: str, piece_type: str, size: Tuple[int, int]) -> pygame.Surface:
+        # Fallback: render text
+        avg_size = (size[0] + size[1]) // 2
+        font = pygame.font.Font(None, avg_size)
+        symbols = {'P': '♙♟', 'N': '♘♞', 'B': '♗♝', 'R': '♖♜', 'Q': '♕♛', 'K': '♔♚'}
+        symbol = symbols[piece_type][0 if color == 'w' else 1]
+        text = font.render(symbol, True, (255, 255, 255) if color == 'w' else (0, 0, 0))
+        return text
+    
+    def get_board_surface(self, width: int, height: int) -> pygame.Surface:
+        """Get board surface scaled to given width and height"""
+        if self.board_image:
+            return self._get_resident(self.board_image, (width, height))
+        if self.fallback_board is None or self.fallback_board.get_size() != (width, height):
+            self.fallback_board = self._render_plain_board(width, height)
+        return self.fallback_board
+    
+    def _render_plain_board(self, width: int, height: int) -> pygame.Surface:
+        # Fallback: solid colors (brown theme) - rectangular squares
+        surface = pygame.Surface((width, height))
+        sq_w = width // 8
+        sq_h = height // 8
+        light = (240, 217, 181)
+        dark = (181, 136, 99)
         
-        # Last move highlighting
-        self.last_move_from = None
-        self.last_move_to = None
+        for rank in range(8):
+            for file in range(8):
+                color = light if (file + rank) % 2 == 1 else dark
+                pygame.draw.rect(surface, color, (file * sq_w, rank * sq_h, sq_w, sq_h))
         
-        # Animation (only for click-click moves)
-        self.animating = False
-        self.anim_start_time = 0
-        self.anim_start_pos = None
-        self.anim_end_pos = None
-        self.anim_piece = None
+        return surface
+    
+    def get_check_indicator(self, width: int, height: int) -> Optional[pygame.Surface]:
+        """Get check indicator scaled to square size (width x height)"""
+        if self.check_image:
+            return self._get_resident(self.check_image, (width, height))
+        return None
+    
+    def _get_resident(self, image: ResidentImage, size: Tuple[int, int]) -> pygame.Surface:
+        before = image.scaled
+        surface = image.get(size)
+        if surface is not before:
+            self.enforce_budget()
+        return surface
+    
+    def memory_report(self) -> dict:
+        """Bytes held per asset category"""
+        report = {
+            'pieces': sum(image.nbytes() for image in self.pieces.values())
+                      + sum(surface_bytes(surface) for _, surface in self.fallback_pieces.values()),
+            'board': self.board_image.nbytes() if self.board_image else surface_bytes(self.fallback_board),
+            'check': self.check_image.nbytes() if self.check_image else 0,
+            'sounds': 0,
+        }
+        mixer_format = pygame.mixer.get_init()
+        if mixer_format:
+            freq, size, channels = mixer_format
+            frame_bytes = abs(size) // 8 * channels
+            report['sounds'] = sum(int(sound.get_length() * freq) * frame_bytes
+                                   for sound in self.sounds.values() if sound)
+        return report
+    
+    def enforce_budget(self):
+        """Free memory that is cheap to restore until the assets fit in asset_memory_mb"""
+        budget = self.config.asset_memory_mb * 1024 * 1024
+        if budget <= 0 or sum(self.memory_report().values()) <= budget:
+            return
         
-        # Multi-animation queue for undo
-        self.anim_queue = []
-        self.current_anim_index = 0
-        self.anim_board_states = []  # Store board states for each animation
+        # 1. Headroom above the current size (only costs a reload on the next upsize)
+        images = list(self.pieces.values()) + [self.board_image, self.check_image]
+        for image in images:
+            if image:
+                image.shrink()
+        if sum(self.memory_report().values()) <= budget:
+            return
         
-        # Move history for undo
-        self.move_history = []
+        # 2. Decoded sounds; the PCM cache brings them back without decoding
+        self.sounds = {}
+        if sum(self.memory_report().values()) <= budget:
+            return
         
-        self.running = True
-        self.player_color = chess.WHITE
-        self.flipped = False  # Board orientation
+        # What remains is on screen; report once instead of thrashing reloads
+        if not self.over_budget_reported:
+            self.over_budget_reported = True
+            print(f"Assets need more than asset_memory_mb ({self.config.asset_memory_mb} MB) at this window size")
+    
+    def play_sound(self, sound_name: str):
+        if not self.config.play_sounds:
+            return
+        sound = self.get_sound(sound_name)
+        if sound:
+            self.sound_pool.play(sound, SOUND_PRIORITIES.get(sound_name, 0))
+
+class TextureScreen:
+    """Window drawn through an SDL2 Renderer; blits become texture copies
+
+    Each surface is uploaded once and its texture reused for as long as the
+    surface lives, so a surface must not be modified after it was blitted.
+    """
+    
+    def __init__(self, size: Tuple[int, int], title: str):
+        if sdl2_video is None:
+            raise pygame.error("pygame._sdl2 is not available")
+        self.window = sdl2_video.Window(title, size, resizable=True)
+        try:
+            self.renderer = sdl2_video.Renderer(self.window, accelerated=1)
+        except (pygame.error, RuntimeError):
+            # No GPU: SDL's software renderer still avoids full-surface Python blits
+            self.renderer = sdl2_video.Renderer(self.window, accelerated=0)
+        self.textures = weakref.WeakKeyDictionary()
+    
+    def get_size(self) -> Tuple[int, int]:
+        return self.window.size
+    
+    def blit(self, surface: pygame.Surface, pos: Tuple[float, float]):
+        texture = self.textures.get(surface)
+        if texture is None:
+            # Surfaces with per-pixel alpha get an alpha-blended texture
+            texture = self.textures[surface] = sdl2_video.Texture.from_surface(self.renderer, surface)
+        texture.draw(dstrect=(int(pos[0]), int(pos[1]), surface.get_width(), surface.get_height()))
+    
+    def fill(self, color: tuple, rect=None):
+        self.renderer.draw_color = tuple(color) + (255,) * (4 - len(color))
+        if rect is None:
+            self.renderer.clear()
+        else:
+            self.renderer.fill_rect(rect)
+    
+    def set_caption(self, title: str):
+        self.window.title = title
+    
+    def flip(self):
+        self.renderer.present()
+
+class BoardView:
+    """Board, piece, marker and arrow drawing onto self.screen
+
+    Shared by the interactive window and the headless diagram renderer.
+    Subclasses provide config, assets, screen, window_width/height, board,
+    flipped, markers, arrows and the highlight/drag/animation state.
+    """
+    
+    def board_height(self) -> int:
+        """Height of the board area; the window may keep a strip below it"""
+        return self.window_height
     
     def square_size(self) -> Tuple[int, int]:
         """Calculate square width and height based on window dimensions"""
         square_width = self.window_width // BOARD_SIZE
-        square_height = self.window_height // BOARD_SIZE
+        square_height = self.board_height() // BOARD_SIZE
         return (square_width, square_height)
     
     def board_offset_x(self) -> int:
@@ -477,22 +3015,6 @@ class ChessUI:
         """Calculate Y offset - no offset needed now"""
         return 0
     
-    def get_square_from_pos(self, pos: Tuple[int, int]) -> Optional[Tuple[int, int]]:
-        x, y = pos
-        sq_w, sq_h = self.square_size()
-        
-        if 0 <= x < self.window_width and 0 <= y < self.window_height:
-            file = x // sq_w
-            rank = 7 - (y // sq_h)
-            
-            # Flip board if playing as black
-            if self.flipped:
-                file = 7 - file
-                rank = 7 - rank
-            
-            return (file, rank)
-        return None
-    
     def square_to_pos(self, square: Tuple[int, int]) -> Tuple[int, int]:
         file, rank = square
         
@@ -507,28 +3029,36 @@ class ChessUI:
         y = (7 - rank) * sq_h
         return (x, y)
     
-    def format_move(self, move: chess.Move, board: chess.Board) -> str:
-        """Format move according to configured notation scheme"""
-        scheme = self.config.notation_scheme
-        
-        if scheme == NotationScheme.ALGEBRAIC:
-            return NotationConverter.to_algebraic(move, board)
-        elif scheme == NotationScheme.COORDINATE:
-            return NotationConverter.to_coordinate(move)
-        elif scheme == NotationScheme.ICCF:
-            return NotationConverter.to_iccf(move)
-        elif scheme == NotationScheme.DESCRIPTIVE:
-            return NotationConverter.to_descriptive(move, board)
-        elif scheme == NotationScheme.FEN:
-            # For FEN, we'll show the move in algebraic first, then the resulting FEN
-            move_str = NotationConverter.to_algebraic(move, board)
-            return move_str  # FEN will be printed separately
-        else:
-            return NotationConverter.to_algebraic(move, board)
+    def cached_overlay(self, key: tuple, build) -> pygame.Surface:
+        """Overlay surface built once per key; the same surface is reused every frame
+
+        Reusing surfaces also lets the texture backend upload each overlay once.
+        """
+        surface = self.overlays.get(key)
+        if surface is None:
+            if len(self.overlays) > 64:
+                # Old square sizes after resizes
+                self.overlays.clear()
+            surface = self.overlays[key] = build()
+        return surface
+    
+    def square_overlay(self, color: tuple, size: Tuple[int, int]) -> pygame.Surface:
+        """Translucent square fill"""
+        def build():
+            surface = pygame.Surface(size, pygame.SRCALPHA)
+            surface.fill(color)
+            return surface
+        return self.cached_overlay(('fill', color, size), build)
+    
+    def board_to_draw(self) -> chess.Board:
+        return self.board
+    
+    def in_check(self) -> bool:
+        return self.board.is_check()
     
     def draw_board(self):
         # Draw board theme - full window size
-        board_surface = self.assets.get_board_surface(self.window_width, self.window_height)
+        board_surface = self.assets.get_board_surface(self.window_width, self.board_height())
         self.screen.blit(board_surface, (0, 0))
         
         # Draw last move highlighting
@@ -537,20 +3067,16 @@ class ChessUI:
             
             # Draw "from" square (lighter yellow)
             from_x, from_y = self.square_to_pos(self.last_move_from)
-            from_highlight = pygame.Surface((sq_w, sq_h), pygame.SRCALPHA)
             from_color = self.config.last_move_from_color + (180,)  # Add alpha
-            from_highlight.fill(from_color)
-            self.screen.blit(from_highlight, (from_x, from_y))
+            self.screen.blit(self.square_overlay(from_color, (sq_w, sq_h)), (from_x, from_y))
             
             # Draw "to" square (darker yellow - 30% darker)
             to_x, to_y = self.square_to_pos(self.last_move_to)
-            to_highlight = pygame.Surface((sq_w, sq_h), pygame.SRCALPHA)
             to_color = self.config.last_move_to_color + (180,)  # Add alpha
-            to_highlight.fill(to_color)
-            self.screen.blit(to_highlight, (to_x, to_y))
+            self.screen.blit(self.square_overlay(to_color, (sq_w, sq_h)), (to_x, to_y))
         
         # Draw check indicator if king is in check
-        if self.board.is_check():
+        if self.in_check():
             king_square = self.board.king(self.board.turn)
             if king_square is not None:
                 king_file = chess.square_file(king_square)
@@ -568,12 +3094,373 @@ class ChessUI:
             sq_w, sq_h = self.square_size()
             x, y = self.square_to_pos(self.selected_square)
             
-            highlight = pygame.Surface((sq_w, sq_h), pygame.SRCALPHA)
-            highlight.fill(self.selected_color)
-            self.screen.blit(highlight, (x, y))
+            self.screen.blit(self.square_overlay(self.selected_color, (sq_w, sq_h)), (x, y))
+    
+    def draw_pieces(self):
+        sq_w, sq_h = self.square_size()
+        
+        # Determine which board state to use for drawing
+        current_board = self.board_to_draw()
+        if self.anim_queue and self.current_anim_index < len(self.anim_board_states):
+            current_board = self.anim_board_states[self.current_anim_index]
+        
+        for square in chess.SQUARES:
+            piece = current_board.piece_at(square)
+            if piece:
+                file = chess.square_file(square)
+                rank = chess.square_rank(square)
+                
+                # Skip piece being dragged
+                if self.dragging_piece and (file, rank) == self.dragging_from_square:
+                    continue
+                
+                # Skip piece being animated (single animation)
+                if self.animating and self.anim_piece and (file, rank) == self.anim_end_pos:
+                    continue
+                
+                # Skip pieces being animated in queue (undo animations)
+                # Only skip the CURRENT animation, not future ones
+                if self.anim_queue and self.current_anim_index < len(self.anim_queue):
+                    anim = self.anim_queue[self.current_anim_index]
+                    # Skip piece at both start and end positions ONLY for current animation
+                    if (file, rank) == anim['start_pos'] or (file, rank) == anim['end_pos']:
+                        continue
+                
+                x, y = self.square_to_pos((file, rank))
+                # Scale piece to fit rectangular square
+                piece_size = (int(sq_w * 0.9), int(sq_h * 0.9))
+                piece_img = self.assets.get_piece_image(piece, piece_size)
+                
+                if piece_img:
+                    offset_x = (sq_w - piece_img.get_width()) // 2
+                    offset_y = (sq_h - piece_img.get_height()) // 2
+                    self.screen.blit(piece_img, (x + offset_x, y + offset_y))
+    
+    def draw_markers(self):
+        sq_w, sq_h = self.square_size()
+        
+        for marker in self.markers:
+            x, y = self.square_to_pos(marker.square)
+            
+            # Create rect for ellipse - use marker_radius_ratio for both dimensions
+            marker_w = int(sq_w * self.config.marker_radius_ratio)
+            marker_h = int(sq_h * self.config.marker_radius_ratio)
+            
+            # Center the ellipse in the square
+            rect_x = x + (sq_w - marker_w) // 2
+            rect_y = y + (sq_h - marker_h) // 2
+            
+            # Draw ellipse (oval) instead of circle
+            rect = pygame.Rect(rect_x, rect_y, marker_w, marker_h)
+            pygame.draw.ellipse(self.screen, self.config.marker_color, rect, self.config.marker_thickness)
+    
+    def draw_arrows(self):
+        sq_w, sq_h = self.square_size()
+        
+        for arrow in self.arrows:
+            start_x, start_y = self.square_to_pos(arrow.start)
+            end_x, end_y = self.square_to_pos(arrow.end)
+            
+            start_center = (start_x + sq_w // 2, start_y + sq_h // 2)
+            end_center = (end_x + sq_w // 2, end_y + sq_h // 2)
+            
+            # Draw line
+            pygame.draw.line(self.screen, self.config.arrow_color,
+                           start_center, end_center, self.config.arrow_thickness)
+            
+            # Draw arrowhead
+            import math
+            dx = end_center[0] - start_center[0]
+            dy = end_center[1] - start_center[1]
+            angle = math.atan2(dy, dx)
+            
+            avg_size = (sq_w + sq_h) // 2
+            arrow_size = avg_size // 3
+            left_angle = angle + 2.5
+            right_angle = angle - 2.5
+            
+            left_x = end_center[0] - arrow_size * math.cos(left_angle)
+            left_y = end_center[1] - arrow_size * math.sin(left_angle)
+            right_x = end_center[0] - arrow_size * math.cos(right_angle)
+            right_y = end_center[1] - arrow_size * math.sin(right_angle)
+            
+            pygame.draw.polygon(self.screen, self.config.arrow_color,
+                              [end_center, (left_x, left_y), (right_x, right_y)])
+
+class ChessUI(BoardView):
+    def __init__(self, config: Config, replay: Optional[GameReplay] = None):
+        self.config = config
+        
+        # Read-only replay of a loaded game
+        self.replay = replay
+        self.scrubbing = False
+        
+        # Game state and rules; a configured game server hosts the game instead
+        self.game = self.create_game()
+        
+        # Initialize pygame first
+        pygame.init()
+        pygame.mixer.init()
+        
+        # Now load assets (which need mixer initialized)
+        self.assets = AssetManager(config)
+        
+        # Initialize engine (optional - the board works without it)
+        self.engine = self.start_engine()
+        
+        self.window_size = WINDOW_SIZE
+        
+        # Background analysis engine; its graph gets a strip below the board
+        self.analyzer = self.start_analyzer()
+        
+        # Create resizable window - can be rectangular
+        self.window_width = self.window_size
+        self.window_height = self.window_size + self.graph_height()
+        self.screen = self.create_screen()
+        self.set_caption('Offline Chess')
+        # Translucent overlays reused across frames; markers and arrows as one layer
+        self.overlays = {}
+        self.annotation_layer = (None, None)
+        
+        # Active Ctrl+P profiling capture
+        self.profiler: Optional[ProfileSession] = None
+        
+        self.scheduler = FrameScheduler(config)
+        self.needs_redraw = True
+        
+        # Engine searches run in a background thread and report via ENGINE_MOVE_EVENT
+        self.engine_thinking = False
+        
+        # Live broadcast to spectators, or read-only spectator mode
+        self.broadcaster = None
+        if config.broadcast and not config.spectate:
+            try:
+                self.broadcaster = Broadcaster(config.broadcast, self.board.fen())
+            except OSError as e:
+                print(f"Broadcast unavailable ({e})")
+        self.spectator_feed = None
+        self.broadcast_ply = 0
+        if config.spectate:
+            try:
+                self.spectator_feed = SpectatorFeed(config.spectate)
+            except (OSError, ValueError) as e:
+                print(f"Cannot watch broadcast at {config.spectate} ({e})")
+        
+        # Background analysis: (position hash, FEN, move leading to it) of the game line
+        self.analysis_line: List[Tuple[int, str, Optional[chess.Move]]] = []
+        self.analysis_signature = None
+        self.annotated = set()
+        self.eval_graph = (None, None)
+        
+        # Selection and move indicators - use circle_color from config
+        self.update_overlay_colors()
+        
+        # Watch config.json for live changes
+        self.config_watcher = ConfigWatcher(config)
+        
+        # Input state
+        self.selected_square = None
+        self.dragging_piece = None
+        self.dragging_from_square = None
+        self.drag_pos = None
+        self.input_mode = InputMode.NONE
+        
+        # Arrow drawing state
+        self.arrow_start = None
+        
+        # Markers and arrows
+        self.arrows: List[Arrow] = []
+        self.markers: List[Marker] = []
+        
+        # Last move highlighting
+        self.last_move_from = None
+        self.last_move_to = None
+        
+        # Moves entered while the engine is to move, played as soon as it replies
+        self.premoves: deque = deque()
+        
+        # Animation (only for click-click moves)
+        self.animating = False
+        self.anim_start_time = 0
+        self.anim_start_pos = None
+        self.anim_end_pos = None
+        self.anim_piece = None
+        
+        # Multi-animation queue for undo
+        self.anim_queue = []
+        self.current_anim_index = 0
+        self.anim_board_states = []  # Store board states for each animation
+        
+        self.running = True
+        self.flipped = False  # Board orientation
+        
+        # Puzzle mode: input is checked against the solution, replies come from the stored line
+        self.puzzle: Optional[Puzzle] = None
+        self.puzzle_index = 0  # Next move of the solution line
+        self.puzzles = None
+        if config.puzzle_mode and not config.spectate and not replay:
+            self.puzzles = PuzzlePrefetcher(config.puzzle_db, config.puzzle_rating_min,
+                                            config.puzzle_rating_max, config.puzzle_theme)
+            self.next_puzzle()
+    
+    @property
+    def board(self) -> chess.Board:
+        return self.game.board
+    
+    @property
+    def move_history(self) -> List[chess.Move]:
+        return self.game.move_history
+    
+    @property
+    def notation_plies(self) -> List[PlyNotation]:
+        return self.game.notation_plies
+    
+    @property
+    def player_color(self) -> chess.Color:
+        return self.game.player_color
+    
+    def create_game(self) -> ChessGame:
+        if self.replay:
+            # The replay owns the board; seeks may swap in a checkpoint copy
+            game = ChessGame(self.replay.board.fen())
+            game.set_board(self.replay.board)
+            return game
+        if self.config.game_server:
+            try:
+                connection = GameServerConnection(self.config.game_server)
+                return RemoteGame(connection, self.config.starting_fen)
+            except GameServerError as e:
+                print(f"{e}, playing locally")
+        return ChessGame(self.config.starting_fen)
+    
+    def start_engine(self):
+        """Connect to the engine daemon if configured, else spawn a local engine"""
+        if self.config.spectate or self.replay:
+            # Spectators and replays only watch
+            return None
+        if isinstance(self.game, RemoteGame) and self.game.connection is not None:
+            # The game server runs the engine; once offline a local engine takes over
+            return ServerEngine(self.game)
+        if self.config.engine_daemon:
+            try:
+                return EngineClient(
+                    self.config.engine_daemon,
+                    self.config.stockfish_depth,
+                    self.config.stockfish_time,
+                    self.config.engine_timeout
+                )
+            except EngineError as e:
+                print(f"{e}, starting a local engine")
+        try:
+            return StockfishEngine(
+                self.config.stockfish_path,
+                self.config.stockfish_depth,
+                self.config.stockfish_time,
+                self.config.engine_timeout,
+                self.config.engine_options
+            )
+        except (OSError, EngineError) as e:
+            print(f"Stockfish unavailable ({e}), playing without engine")
+            return None
+    
+    def start_analyzer(self) -> Optional[GameAnalyzer]:
+        if not self.config.analysis or self.config.spectate:
+            return None
+        threads = self.config.analysis_threads
+        if not threads:
+            playing_threads = int(self.config.engine_options.get('Threads', 1))
+            threads = max(1, (os.cpu_count() or 1) - playing_threads - 1)
+        try:
+            return GameAnalyzer(
+                self.config.stockfish_path,
+                self.config.analysis_depth,
+                threads,
+                self.config.engine_timeout,
+                on_result=lambda key: pygame.event.post(pygame.event.Event(ANALYSIS_EVENT, key=key))
+            )
+        except (OSError, EngineError) as e:
+            print(f"Analysis unavailable ({e})")
+            return None
+    
+    def graph_height(self) -> int:
+        return EVAL_GRAPH_HEIGHT if self.analyzer else 0
+    
+    def board_height(self) -> int:
+        return max(BOARD_SIZE, self.window_height - self.graph_height())
+    
+    def create_screen(self):
+        """Texture renderer window if configured and available, else a display surface"""
+        size = (self.window_width, self.window_height)
+        if self.config.render_backend == 'texture':
+            try:
+                return TextureScreen(size, 'Offline Chess')
+            except (pygame.error, RuntimeError) as e:
+                print(f"Texture renderer unavailable ({e}), using surface rendering")
+        return pygame.display.set_mode(size, pygame.RESIZABLE)
+    
+    def set_caption(self, title: str):
+        if isinstance(self.screen, TextureScreen):
+            self.screen.set_caption(title)
+        else:
+            pygame.display.set_caption(title)
+    
+    def update_overlay_colors(self):
+        """Derive selection and legal move indicator colors from circle_color"""
+        self.selected_color = tuple(list(self.config.circle_color) + [128])  # Semi-transparent green
+        self.legal_move_color = self.config.circle_color
+        
+        # Calculate lighter capture indicator color (30% lighter)
+        self.capture_color = tuple(min(255, int(c * 1.3)) for c in self.config.circle_color)
+    
+    def apply_config_changes(self, changed: set):
+        """Invalidate only the subsystems affected by changed settings"""
+        if 'board_theme' in changed:
+            self.assets.reload_board_theme()
+        if 'piece_theme' in changed:
+            self.assets.reload_pieces()
+        if 'circle_color' in changed:
+            self.update_overlay_colors()
+        if 'asset_memory_mb' in changed:
+            self.assets.over_budget_reported = False
+            self.assets.enforce_budget()
+        if changed & {'stockfish_path', 'engine_daemon'} or self.engine is None:
+            # A different binary needs a fresh process
+            if self.engine:
+                self.engine.close()
+            self.engine = self.start_engine()
+        else:
+            if changed & {'stockfish_depth', 'stockfish_time', 'engine_timeout'}:
+                self.engine.configure(self.config.stockfish_depth, self.config.stockfish_time,
+                                      self.config.engine_timeout)
+            if 'engine_options' in changed and isinstance(self.engine, StockfishEngine):
+                # UCI options apply to a running engine; only send the ones that differ
+                for name, value in self.config.engine_options.items():
+                    if self.engine.options.get(name) != value:
+                        self.engine.set_option(name, value)
+        # Other settings (animation_speed, arrow/marker colors, sounds, notation,
+        # starting_fen) are read directly from config where they are used
+        if changed:
+            print(f"Config reloaded: {', '.join(sorted(changed))}")
+    
+    def get_square_from_pos(self, pos: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        x, y = pos
+        sq_w, sq_h = self.square_size()
+        
+        if 0 <= x < self.window_width and 0 <= y < self.board_height():
+            file = x // sq_w
+            rank = 7 - (y // sq_h)
+            
+            # Flip board if playing as black
+            if self.flipped:
+                file = 7 - file
+                rank = 7 - rank
+            
+            return (file, rank)
+        return None
     
     def draw_legal_moves(self):
-        if self.selected_square:
+        # Premove targets are unknown until the engine replies
+        if self.selected_square and not self.can_premove():
             sq = chess.square(self.selected_square[0], self.selected_square[1])
             piece = self.board.piece_at(sq)
             
@@ -586,67 +3473,37 @@ class ChessUI:
                         to_rank = chess.square_rank(move.to_square)
                         x, y = self.square_to_pos((to_file, to_rank))
                         
-                        # Create semi-transparent surface for indicators
-                        indicator = pygame.Surface((sq_w, sq_h), pygame.SRCALPHA)
-                        
-                        if self.board.piece_at(move.to_square):
-                            # Capture indicator (ring around edge)
-                            color_with_alpha = tuple(list(self.capture_color) + [180])
-                            # Draw ellipse ring
-                            outer_rect = pygame.Rect(3, 3, sq_w - 6, sq_h - 6)
-                            pygame.draw.ellipse(indicator, color_with_alpha, outer_rect, self.config.circle_thickness)
-                        else:
-                            # Move indicator (filled ellipse with configurable ratio)
-                            dot_w = int(sq_w * self.config.circle_radius_ratio * 2)
-                            dot_h = int(sq_h * self.config.circle_radius_ratio * 2)
-                            dot_x = (sq_w - dot_w) // 2
-                            dot_y = (sq_h - dot_h) // 2
-                            
-                            color_with_alpha = tuple(list(self.legal_move_color) + [180])
-                            dot_rect = pygame.Rect(dot_x, dot_y, dot_w, dot_h)
-                            pygame.draw.ellipse(indicator, color_with_alpha, dot_rect)
-                        
-                        self.screen.blit(indicator, (x, y))
+                        capture = self.board.piece_at(move.to_square) is not None
+                        self.screen.blit(self.move_indicator(capture, (sq_w, sq_h)), (x, y))
     
-    def draw_pieces(self):
-        sq_w, sq_h = self.square_size()
-        
-        # Determine which board state to use for drawing
-        current_board = self.board
-        if self.anim_queue and self.current_anim_index < len(self.anim_board_states):
-            current_board = self.anim_board_states[self.current_anim_index]
+    def move_indicator(self, capture: bool, size: Tuple[int, int]) -> pygame.Surface:
+        sq_w, sq_h = size
         
-        for square in chess.SQUARES:
-            piece = current_board.piece_at(square)
-            if piece:
-                file = chess.square_file(square)
-                rank = chess.square_rank(square)
-                
-                # Skip piece being dragged
-                if self.dragging_piece and (file, rank) == self.dragging_from_square:
-                    continue
-                
-                # Skip piece being animated (single animation)
-                if self.animating and self.anim_piece and (file, rank) == self.anim_end_pos:
-                    continue
-                
-                # Skip pieces being animated in queue (undo animations)
-                # Only skip the CURRENT animation, not future ones
-                if self.anim_queue and self.current_anim_index < len(self.anim_queue):
-                    anim = self.anim_queue[self.current_anim_index]
-                    # Skip piece at both start and end positions ONLY for current animation
-                    if (file, rank) == anim['start_pos'] or (file, rank) == anim['end_pos']:
-                        continue
-                
-                x, y = self.square_to_pos((file, rank))
-                # Scale piece to fit rectangular square
-                piece_size = (int(sq_w * 0.9), int(sq_h * 0.9))
-                piece_img = self.assets.get_piece_image(piece, piece_size)
+        def build():
+            # Create semi-transparent surface for indicators
+            indicator = pygame.Surface((sq_w, sq_h), pygame.SRCALPHA)
+            
+            if capture:
+                # Capture indicator (ring around edge)
+                color_with_alpha = tuple(list(self.capture_color) + [180])
+                # Draw ellipse ring
+                outer_rect = pygame.Rect(3, 3, sq_w - 6, sq_h - 6)
+                pygame.draw.ellipse(indicator, color_with_alpha, outer_rect, self.config.circle_thickness)
+            else:
+                # Move indicator (filled ellipse with configurable ratio)
+                dot_w = int(sq_w * self.config.circle_radius_ratio * 2)
+                dot_h = int(sq_h * self.config.circle_radius_ratio * 2)
+                dot_x = (sq_w - dot_w) // 2
+                dot_y = (sq_h - dot_h) // 2
                 
-                if piece_img:
-                    offset_x = (sq_w - piece_img.get_width()) // 2
-                    offset_y = (sq_h - piece_img.get_height()) // 2
-                    self.screen.blit(piece_img, (x + offset_x, y + offset_y))
+                color_with_alpha = tuple(list(self.legal_move_color) + [180])
+                dot_rect = pygame.Rect(dot_x, dot_y, dot_w, dot_h)
+                pygame.draw.ellipse(indicator, color_with_alpha, dot_rect)
+            return indicator
+        
+        key = ('capture' if capture else 'move', self.capture_color, self.legal_move_color,
+               self.config.circle_thickness, self.config.circle_radius_ratio, size)
+        return self.cached_overlay(key, build)
     
     def draw_dragging_piece(self):
         if self.dragging_piece and self.drag_pos:
@@ -717,57 +3574,6 @@ class ChessUI:
             if progress >= 1.0:
                 self.animating = False
     
-    def draw_markers(self):
-        sq_w, sq_h = self.square_size()
-        
-        for marker in self.markers:
-            x, y = self.square_to_pos(marker.square)
-            
-            # Create rect for ellipse - use marker_radius_ratio for both dimensions
-            marker_w = int(sq_w * self.config.marker_radius_ratio)
-            marker_h = int(sq_h * self.config.marker_radius_ratio)
-            
-            # Center the ellipse in the square
-            rect_x = x + (sq_w - marker_w) // 2
-            rect_y = y + (sq_h - marker_h) // 2
-            
-            # Draw ellipse (oval) instead of circle
-            rect = pygame.Rect(rect_x, rect_y, marker_w, marker_h)
-            pygame.draw.ellipse(self.screen, self.config.marker_color, rect, self.config.marker_thickness)
-    
-    def draw_arrows(self):
-        sq_w, sq_h = self.square_size()
-        
-        for arrow in self.arrows:
-            start_x, start_y = self.square_to_pos(arrow.start)
-            end_x, end_y = self.square_to_pos(arrow.end)
-            
-            start_center = (start_x + sq_w // 2, start_y + sq_h // 2)
-            end_center = (end_x + sq_w // 2, end_y + sq_h // 2)
-            
-            # Draw line
-            pygame.draw.line(self.screen, self.config.arrow_color,
-                           start_center, end_center, self.config.arrow_thickness)
-            
-            # Draw arrowhead
-            import math
-            dx = end_center[0] - start_center[0]
-            dy = end_center[1] - start_center[1]
-            angle = math.atan2(dy, dx)
-            
-            avg_size = (sq_w + sq_h) // 2
-            arrow_size = avg_size // 3
-            left_angle = angle + 2.5
-            right_angle = angle - 2.5
-            
-            left_x = end_center[0] - arrow_size * math.cos(left_angle)
-            left_y = end_center[1] - arrow_size * math.sin(left_angle)
-            right_x = end_center[0] - arrow_size * math.cos(right_angle)
-            right_y = end_center[1] - arrow_size * math.sin(right_angle)
-            
-            pygame.draw.polygon(self.screen, self.config.arrow_color,
-                              [end_center, (left_x, left_y), (right_x, right_y)])
-    
     def clear_markers_and_arrows(self):
         self.markers.clear()
         self.arrows.clear()
@@ -788,10 +3594,6 @@ class ChessUI:
         if animate:
             self.animate_move(move)
         
-        is_capture = self.board.is_capture(move)
-        is_castle = self.board.is_castling(move)
-        is_check_before = self.board.is_check()
-        
         # Store last move for highlighting
         from_file = chess.square_file(move.from_square)
         from_rank = chess.square_rank(move.from_square)
@@ -801,48 +3603,129 @@ class ChessUI:
         self.last_move_from = (from_file, from_rank)
         self.last_move_to = (to_file, to_rank)
         
-        # Record move in history
-        if record_history:
-            self.move_history.append(move)
-        
-        # Print move in configured notation with color prefix
-        move_notation = self.format_move(move, self.board)
+        # Record move in history; every notation of the ply is computed once here
+        ply = self.game.make_move(move, record_history)
         
         # Determine which color made the move (before pushing)
-        color_prefix = "White:" if self.board.turn == chess.WHITE else "Black:"
+        color_prefix = "White:" if ply.color == chess.WHITE else "Black:"
         
         # If using FEN notation, print both the move and resulting FEN
         if self.config.notation_scheme == NotationScheme.FEN:
-            print(f"{color_prefix} {move_notation}")
-            # Push the move first to get the resulting position
-            self.board.push(move)
-            fen = NotationConverter.to_fen(self.board)
-            print(f"FEN: {fen}")
-            # We already pushed, so don't push again below
-            move_already_pushed = True
+            print(f"{color_prefix} {ply.san}")
+            print(f"FEN: {ply.fen}")
         else:
-            print(f"{color_prefix} {move_notation}")
-            move_already_pushed = False
-        
-        # Push move to board if not already done
-        if not move_already_pushed:
-            self.board.push(move)
+            print(f"{color_prefix} {ply.format(self.config.notation_scheme)}")
         
         # Play sound
-        if self.board.is_checkmate():
-            self.assets.play_sound('end')
-        elif self.board.is_check():
-            self.assets.play_sound('check')
-        elif move.promotion:
-            self.assets.play_sound('promote')
-        elif is_castle:
-            self.assets.play_sound('castle')
-        elif is_capture:
-            self.assets.play_sound('capture')
-        else:
-            self.assets.play_sound('move')
+        self.assets.play_sound(ply.sound())
+        
+        if self.broadcaster:
+            self.broadcaster.publish_move(move)
+        
+        # The engine just replied: a queued premove goes out in the same frame
+        if self.premoves and not self.game.is_engine_turn():
+            self.play_premove()
+    
+    def player_move(self, move: chess.Move, animate: bool) -> bool:
+        """Play a move entered on the board; in puzzle mode it must follow the solution"""
+        if self.puzzle and not self.is_puzzle_solution(move):
+            print("Wrong move, try again")
+            self.assets.play_sound('notify')
+            return False
+        
+        self.make_move(move, animate=animate)
+        if self.puzzle:
+            self.advance_puzzle()
+        return True
+    
+    def is_puzzle_solution(self, move: chess.Move) -> bool:
+        if self.puzzle_index >= len(self.puzzle.moves):
+            return False
+        if move.uci() == self.puzzle.moves[self.puzzle_index]:
+            return True
+        # Any mate is as good as the stored one
+        self.board.push(move)
+        is_mate = self.board.is_checkmate()
+        self.board.pop()
+        return is_mate
+    
+    def advance_puzzle(self):
+        self.puzzle_index += 1
+        if self.puzzle_index >= len(self.puzzle.moves) or self.game.status.checkmate:
+            self.puzzle_index = len(self.puzzle.moves)
+            print("Puzzle solved")
+            pygame.time.set_timer(PUZZLE_NEXT_EVENT, 1000, loops=1)
+    
+    def load_puzzle(self, puzzle: Puzzle):
+        self.puzzle = puzzle
+        self.puzzle_index = 0
+        self.game.reset(puzzle.fen)
+        # The first move is the opponent's; the player solves for the other side
+        self.game.player_color = not self.board.turn
+        self.flipped = self.player_color == chess.BLACK
+        self.reset_view()
+        if self.broadcaster:
+            self.broadcaster.publish_reset(self.board.fen())
+        print(f"Puzzle {puzzle.puzzle_id} ({puzzle.rating}): {' '.join(puzzle.themes)}")
+    
+    def next_puzzle(self):
+        puzzle = self.puzzles.next()
+        if puzzle is None:
+            print(f"No puzzles in {self.config.puzzle_db} for this rating/theme")
+            return
+        self.load_puzzle(puzzle)
+    
+    def can_premove(self) -> bool:
+        """Player input is queued as premoves while an engine is to move in a normal game"""
+        return (self.engine is not None and not self.puzzle and not self.replay
+                and not self.config.spectate and self.game.is_engine_turn())
+    
+    def premove_board(self) -> chess.Board:
+        """Position with the queued premoves applied as piece relocations (legality unknown yet)"""
+        board = self.board.copy(stack=False)
+        for move in self.premoves:
+            piece = board.remove_piece_at(move.from_square)
+            if piece and piece.piece_type == chess.PAWN and chess.square_rank(move.to_square) in (0, 7):
+                piece = chess.Piece(chess.QUEEN, piece.color)
+            board.set_piece_at(move.to_square, piece)
+        return board
+    
+    def queue_premove(self, from_sq: int, to_sq: int):
+        if from_sq != to_sq:
+            self.premoves.append(chess.Move(from_sq, to_sq))
+    
+    def play_premove(self):
+        """Play the first queued premove right after the engine's reply"""
+        move = self.game.find_move(self.premoves[0].from_square, self.premoves[0].to_square)
+        if move is None:
+            # Later premoves assumed this one, so the whole queue goes
+            print("Premove illegal, discarded")
+            self.premoves.clear()
+            return
+        self.premoves.popleft()
+        self.player_move(move, animate=False)
+    
+    def board_to_draw(self) -> chess.Board:
+        return self.premove_board() if self.premoves else self.board
+    
+    def in_check(self) -> bool:
+        return self.game.status.check
+    
+    def draw_premoves(self):
+        sq_w, sq_h = self.square_size()
+        color = tuple(self.config.premove_color) + (160,)
+        for move in self.premoves:
+            for square in (move.from_square, move.to_square):
+                x, y = self.square_to_pos((chess.square_file(square), chess.square_rank(square)))
+                self.screen.blit(self.square_overlay(color, (sq_w, sq_h)), (x, y))
     
     def handle_mouse_down(self, pos: Tuple[int, int], button: int):
+        # Replay scrub bar
+        if self.replay and button == 1 and pos[1] >= self.window_height - REPLAY_BAR_HEIGHT:
+            self.scrubbing = True
+            self.scrub_to(pos[0])
+            return
+        
         square = self.get_square_from_pos(pos)
         
         if button == 1:  # Left click
@@ -851,10 +3734,18 @@ class ChessUI:
             
             if square:
                 sq = chess.square(square[0], square[1])
-                piece = self.board.piece_at(sq)
+                # While the engine is to move, own pieces are picked up as premoves
+                premove = self.can_premove()
+                input_board = self.premove_board() if premove else self.board
+                own_color = self.player_color if premove else self.board.turn
+                piece = input_board.piece_at(sq)
+                
+                # Board is locked while the engine is searching, when spectating or replaying
+                if (self.engine_thinking and not premove) or self.config.spectate or self.replay:
+                    self.selected_square = None
                 
                 # If clicking on own piece, either select it or start dragging
-                if piece and piece.color == self.board.turn:
+                elif piece and piece.color == own_color:
                     # If same piece clicked, deselect it
                     if self.selected_square == square:
                         self.selected_square = None
@@ -872,38 +3763,31 @@ class ChessUI:
                 elif self.selected_square:
                     # Try to make move (click-click mode with animation)
                     from_sq = chess.square(self.selected_square[0], self.selected_square[1])
-                    to_sq = sq
-                    move = chess.Move(from_sq, to_sq)
-                    
-                    # Check for promotion
-                    if move in self.board.legal_moves:
-                        self.make_move(move, animate=True)
-                        self.selected_square = None
+                    if premove:
+                        self.queue_premove(from_sq, sq)
                     else:
-                        # Try promotion
-                        moved = False
-                        for promo in [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT]:
-                            promo_move = chess.Move(from_sq, to_sq, promotion=promo)
-                            if promo_move in self.board.legal_moves:
-                                self.make_move(promo_move, animate=True)
-                                self.selected_square = None
-                                moved = True
-                                break
-                        
-                        # If invalid move, deselect
-                        if not moved:
-                            self.selected_square = None
+                        move = self.game.find_move(from_sq, sq)
+                        if move:
+                            self.player_move(move, animate=True)
+                    
+                    # Deselect after a move, or if the move was invalid
+                    self.selected_square = None
                 
                 # Clicking on empty square with no selection - do nothing
                 else:
                     self.selected_square = None
         
         elif button == 3:  # Right click
-            if square:
+            if self.premoves:
+                # Right click cancels queued premoves
+                self.premoves.clear()
+            elif square:
                 self.markers.append(Marker(square))
     
     def handle_mouse_up(self, pos: Tuple[int, int], button: int):
-        if button == 1:
+        if button == 1 and self.scrubbing:
+            self.scrubbing = False
+        elif button == 1:
             square = self.get_square_from_pos(pos)
             
             # Handle drag-and-drop move (NO animation)
@@ -921,22 +3805,15 @@ class ChessUI:
                 if (dx > drag_threshold or dy > drag_threshold) and square:
                     from_sq = chess.square(self.dragging_from_square[0], self.dragging_from_square[1])
                     to_sq = chess.square(square[0], square[1])
-                    move = chess.Move(from_sq, to_sq)
-                    
-                    if move in self.board.legal_moves:
-                        self.make_move(move, animate=False)  # NO animation for drag-drop
+                    if self.can_premove():
+                        self.queue_premove(from_sq, to_sq)
                         self.selected_square = None
                     else:
-                        # Try promotion
-                        for promo in [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT]:
-                            promo_move = chess.Move(from_sq, to_sq, promotion=promo)
-                            if promo_move in self.board.legal_moves:
-                                self.make_move(promo_move, animate=False)  # NO animation
-                                self.selected_square = None
-                                break
-                        else:
-                            # Invalid move - piece stays selected for click-click mode
-                            pass
+                        move = self.game.find_move(from_sq, to_sq)
+                        
+                        if move and self.player_move(move, animate=False):  # NO animation for drag-drop
+                            self.selected_square = None
+                    # Invalid move - piece stays selected for click-click mode
                 # If not dragged (just clicked), keep piece selected for click-click
                 
                 self.dragging_piece = None
@@ -947,14 +3824,59 @@ class ChessUI:
     def handle_mouse_motion(self, pos: Tuple[int, int]):
         if self.dragging_piece:
             self.drag_pos = pos
+        elif self.scrubbing:
+            self.scrub_to(pos[0])
+    
+    def seek_replay(self, target: int):
+        """Show the replay at the given ply; single steps are animated"""
+        target = max(0, min(target, len(self.replay)))
+        step = target - self.replay.ply
+        if step == 0:
+            return
+        
+        self.animating = False
+        if step == 1:
+            # Same animation path as a played move
+            self.animate_move(self.replay.moves[self.replay.ply])
+            self.game.set_board(self.replay.seek(target))
+        elif step == -1:
+            move = self.replay.last_move()
+            self.game.set_board(self.replay.seek(target))
+            self.anim_start_pos = (chess.square_file(move.to_square), chess.square_rank(move.to_square))
+            self.anim_end_pos = (chess.square_file(move.from_square), chess.square_rank(move.from_square))
+            self.anim_piece = self.board.piece_at(move.from_square)
+            self.anim_start_time = time.time()
+            self.animating = True
+        else:
+            self.game.set_board(self.replay.seek(target))
+        
+        move = self.replay.last_move()
+        if move:
+            self.last_move_from = (chess.square_file(move.from_square), chess.square_rank(move.from_square))
+            self.last_move_to = (chess.square_file(move.to_square), chess.square_rank(move.to_square))
+        else:
+            self.last_move_from = None
+            self.last_move_to = None
+        self.set_caption(f'Offline Chess - {self.replay.ply}/{len(self.replay)}')
+    
+    def scrub_to(self, x: int):
+        if len(self.replay):
+            fraction = max(0.0, min(1.0, x / max(1, self.window_width - 1)))
+            self.seek_replay(round(fraction * len(self.replay)))
+    
+    def draw_replay_bar(self):
+        bar = pygame.Rect(0, self.window_height - REPLAY_BAR_HEIGHT, self.window_width, REPLAY_BAR_HEIGHT)
+        overlay = pygame.Surface(bar.size, pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 120))
+        if len(self.replay):
+            done = int(self.window_width * self.replay.ply / len(self.replay))
+            pygame.draw.rect(overlay, self.config.last_move_to_color + (220,), (0, 0, done, REPLAY_BAR_HEIGHT))
+        self.screen.blit(overlay, bar.topleft)
     
     def undo_move(self):
         """Undo last two moves (player + engine) with animation"""
-        if not self.animating and len(self.move_history) >= 2:
-            # Get last two moves
-            engine_move = self.move_history.pop()
-            player_move = self.move_history.pop()
-            
+        self.premoves.clear()
+        if not self.animating and self.game.can_undo():
             # Store board states for each animation step
             self.anim_board_states = []
             
@@ -963,14 +3885,18 @@ class ChessUI:
             self.anim_board_states.append(board_state_1)
             
             # Undo engine move
-            self.board.pop()
+            engine_move = self.game.undo_ply()
             
             # Board state 2: After undoing engine move, before undoing player move
             board_state_2 = self.board.copy()
             self.anim_board_states.append(board_state_2)
             
             # Undo player move
-            self.board.pop()
+            player_move = self.game.undo_ply()
+            
+            if self.broadcaster:
+                self.broadcaster.publish_undo()
+                self.broadcaster.publish_undo()
             
             # Create animation queue for both undos
             self.anim_queue = []
@@ -1017,13 +3943,27 @@ class ChessUI:
             # Clear selection
             self.selected_square = None
     
+    def handle_rejection(self, error: GameServerRejected):
+        """The server refused a change; the game was left as it was, drop what the UI started"""
+        print(f"Game server refused: {error}")
+        self.selected_square = None
+        self.animating = False
+        self.anim_queue = []
+        self.anim_board_states = []
+    
     def reset_game(self):
         """Reset game to starting position from config"""
-        self.board.set_fen(self.config.starting_fen)
-        self.move_history.clear()
+        self.game.reset(self.config.starting_fen)
+        self.reset_view()
+        if self.broadcaster:
+            self.broadcaster.publish_reset(self.board.fen())
+    
+    def reset_view(self):
+        """Clear highlights, selection, annotations and animations"""
         self.last_move_from = None
         self.last_move_to = None
         self.selected_square = None
+        self.premoves.clear()
         self.clear_markers_and_arrows()
         self.animating = False
         self.anim_queue = []
@@ -1032,71 +3972,592 @@ class ChessUI:
     def flip_board(self):
         """Flip board orientation and switch player color"""
         self.flipped = not self.flipped
-        self.player_color = chess.BLACK if self.player_color == chess.WHITE else chess.WHITE
-        # Reset game when switching sides
-        self.reset_game()
+        # Switching sides resets the game
+        self.game.switch_sides(self.config.starting_fen)
+        self.reset_view()
+        if self.broadcaster:
+            self.broadcaster.publish_reset(self.board.fen())
     
     def engine_move(self):
-        if not self.board.is_game_over() and self.board.turn != self.player_color:
-            move = self.engine.get_best_move(self.board)
+        """Start a background search if it is the engine's turn"""
+        if self.puzzle:
+            # Reply from the stored solution line, no search
+            if self.puzzle_index < len(self.puzzle.moves) and self.board.turn != self.player_color:
+                self.make_move(chess.Move.from_uci(self.puzzle.moves[self.puzzle_index]), animate=True)
+                self.advance_puzzle()
+            return
+        if self.engine is None or self.engine_thinking:
+            return
+        if self.game.is_engine_turn():
+            self.engine_thinking = True
+            if self.analyzer:
+                # Keep every core for the reply
+                self.analyzer.pause()
+            board = self.board.copy()
+            threading.Thread(target=self._engine_search, args=(self.engine, board), daemon=True).start()
+    
+    def _engine_search(self, engine: StockfishEngine, board: chess.Board):
+        move, error = None, None
+        try:
+            move = engine.get_best_move(board)
+        except Exception as e:
+            # Any failure must still reach the UI, or engine_thinking never clears
+            error = str(e) or type(e).__name__
+        finally:
+            pygame.event.post(pygame.event.Event(ENGINE_MOVE_EVENT, move=move, fen=board.fen(),
+                                                 engine=engine, error=error))
+    
+    def handle_engine_result(self, move: Optional[chess.Move], fen: str,
+                             engine: Optional[StockfishEngine] = None, error: Optional[str] = None):
+        self.engine_thinking = False
+        if self.analyzer:
+            self.analyzer.resume()
+        if error:
+            # Restart did not help; keep playing without the engine
+            print(f"Engine disabled: {error}")
+            if engine is self.engine:
+                self.engine.close()
+                self.engine = None
+            return
+        # Drop results for a position that was undone or reset meanwhile
+        if move and fen == self.board.fen() and move in self.board.legal_moves:
+            # With a premove queued both moves appear at once, without animation
+            self.make_move(move, animate=not self.premoves)
+    
+    def sync_analysis(self):
+        """Hand the current game line to the analyzer when it changed"""
+        if self.replay:
+            signature = 'replay'  # The whole game is known up front
+        else:
+            signature = (len(self.board.move_stack), self.game.tracker.stack[-1][0])
+        if signature == self.analysis_signature:
+            return
+        self.analysis_signature = signature
+        
+        if self.replay:
+            board, moves = self.replay.checkpoints[0].copy(), self.replay.moves
+        else:
+            board, moves = self.board.root(), self.board.move_stack
+        line = [(chess.polyglot.zobrist_hash(board), board.fen(), None)]
+        for move in moves:
+            board.push(move)
+            line.append((chess.polyglot.zobrist_hash(board), board.fen(), move))
+        self.analysis_line = line
+        self.analyzer.set_positions([(key, fen) for key, fen, _ in line])
+        self.report_analysis()
+    
+    def report_analysis(self):
+        """Print each move's annotation once both of its positions are analyzed"""
+        results = self.analyzer.results
+        for (before_key, before_fen, _), (after_key, _, move) in zip(self.analysis_line, self.analysis_line[1:]):
+            before, after = results.get(before_key), results.get(after_key)
+            if not before or not after or (before_key, after_key) in self.annotated:
+                continue
+            self.annotated.add((before_key, after_key))
+            
+            board = chess.Board(before_fen)
+            glyph = classify_move(before, after, board.turn)
+            number = f"{board.fullmove_number}." if board.turn == chess.WHITE else f"{board.fullmove_number}..."
+            line = f"Analysis: {number} {board.san(move)}{glyph} {after.format()}"
+            if glyph and before.best_move and before.best_move in board.legal_moves:
+                line += f" (best {board.san(before.best_move)})"
+            print(line)
+    
+    def draw_eval_graph(self):
+        """Evaluation per ply (White up) in the strip below the board, current ply marked"""
+        results = self.analyzer.results
+        values = tuple(results[key].value() if key in results else None for key, _, _ in self.analysis_line)
+        current = self.replay.ply if self.replay else len(self.analysis_line) - 1
+        top = self.board_height()
+        # The replay bar keeps the bottom of the window
+        height = max(1, self.window_height - top - (REPLAY_BAR_HEIGHT if self.replay else 0))
+        key = (values, current, self.window_width, height, self.config.last_move_to_color)
+        
+        if self.eval_graph[0] != key:
+            width = self.window_width
+            graph = pygame.Surface((width, height))
+            graph.fill((40, 40, 40))
+            pygame.draw.line(graph, (110, 110, 110), (0, height // 2), (width, height // 2))
+            
+            step = (width - 1) / max(1, len(values) - 1)
+            scale = (height / 2 - 2) / 1000
+            points = [(int(i * step), int(height / 2 - value * scale))
+                      for i, value in enumerate(values) if value is not None]
+            if len(points) > 1:
+                pygame.draw.lines(graph, (240, 240, 240), False, points, 2)
+            if values:
+                marker_x = int(current * step)
+                pygame.draw.line(graph, self.config.last_move_to_color, (marker_x, 0), (marker_x, height), 2)
+            self.eval_graph = (key, graph)
+        
+        self.screen.blit(self.eval_graph[1], (0, top))
+    
+    def handle_broadcast(self, message: Optional[dict]):
+        """Apply a spectator stream message to the read-only board"""
+        if message is None:
+            print("Broadcast ended")
+            self.spectator_feed = None
+            return
+        
+        kind = message.get('t')
+        if kind == 's':
+            # Snapshot: jump to the position and replay the recent moves silently
+            self.game.reset(message['fen'])
+            self.reset_view()
+            move = None
+            for uci in message['m']:
+                move = chess.Move.from_uci(uci)
+                self.game.make_move(move)
             if move:
-                self.make_move(move, animate=True)
+                self.last_move_from = (chess.square_file(move.from_square), chess.square_rank(move.from_square))
+                self.last_move_to = (chess.square_file(move.to_square), chess.square_rank(move.to_square))
+            self.broadcast_ply = message['n']
+        elif kind == 'm':
+            move = chess.Move.from_uci(message['u'])
+            if message['n'] != self.broadcast_ply + 1 or move not in self.board.legal_moves:
+                print(f"Broadcast out of sync at ply {message['n']}")
+                return
+            self.make_move(move, animate=True)
+            self.broadcast_ply = message['n']
+        elif kind == 'u':
+            if self.board.move_stack:
+                self.game.undo_ply()
+            self.reset_view()
+            self.broadcast_ply = message['n']
     
-    def run(self):
-        while self.running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-                
-                elif event.type == pygame.VIDEORESIZE:
-                    # Simply update dimensions, don't call set_mode again
-                    self.window_width = max(event.w, MIN_WINDOW_SIZE)
-                    self.window_height = max(event.h, MIN_WINDOW_SIZE)
-                
-                elif event.type == pygame.KEYDOWN:
-                    # Ctrl+Z: Undo
-                    if event.key == pygame.K_z and (event.mod & pygame.KMOD_CTRL):
-                        self.undo_move()
-                    
-                    # Ctrl+R: Reset game
-                    elif event.key == pygame.K_r and (event.mod & pygame.KMOD_CTRL):
-                        self.reset_game()
-                    
-                    # Ctrl+M: Flip board / Switch sides
-                    elif event.key == pygame.K_m and (event.mod & pygame.KMOD_CTRL):
-                        self.flip_board()
-                
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    self.handle_mouse_down(event.pos, event.button)
-                
-                elif event.type == pygame.MOUSEBUTTONUP:
-                    self.handle_mouse_up(event.pos, event.button)
-                
-                elif event.type == pygame.MOUSEMOTION:
-                    self.handle_mouse_motion(event.pos)
+    def frame_state(self) -> FrameState:
+        if self.animating:
+            return FrameState.ANIMATING
+        if self.dragging_piece or self.scrubbing:
+            return FrameState.INTERACTIVE
+        return FrameState.IDLE
+    
+    def handle_event(self, event: pygame.event.Event):
+        if event.type == pygame.QUIT:
+            self.running = False
+        
+        elif event.type == pygame.VIDEORESIZE:
+            # Simply update dimensions, don't call set_mode again
+            self.window_width = max(event.w, MIN_WINDOW_SIZE)
+            self.window_height = max(event.h, MIN_WINDOW_SIZE)
+        
+        elif event.type == pygame.WINDOWSIZECHANGED and isinstance(self.screen, TextureScreen):
+            # Renderer windows are not the display surface and get no VIDEORESIZE
+            self.window_width = max(event.x, MIN_WINDOW_SIZE)
+            self.window_height = max(event.y, MIN_WINDOW_SIZE)
+        
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_i and (event.mod & pygame.KMOD_CTRL):
+            # Ctrl+I: Asset memory report, in every mode
+            self.print_memory_report()
+        
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_p and (event.mod & pygame.KMOD_CTRL):
+            # Ctrl+P: Start / stop a profiling capture, in every mode
+            self.toggle_profiling()
+        
+        elif event.type == pygame.KEYDOWN and self.config.spectate:
+            # Spectators can only turn the board around
+            if event.key == pygame.K_m and (event.mod & pygame.KMOD_CTRL):
+                self.flipped = not self.flipped
+        
+        elif event.type == pygame.KEYDOWN and self.replay:
+            # Arrows step, Page Up/Down jump 10 plies, Home/End go to the ends
+            steps = {
+                pygame.K_LEFT: -1, pygame.K_RIGHT: 1,
+                pygame.K_PAGEUP: -10, pygame.K_PAGEDOWN: 10,
+                pygame.K_HOME: -len(self.replay), pygame.K_END: len(self.replay)
+            }
+            if event.key in steps:
+                self.seek_replay(self.replay.ply + steps[event.key])
+            
+            # Ctrl+M: Flip board only
+            elif event.key == pygame.K_m and (event.mod & pygame.KMOD_CTRL):
+                self.flipped = not self.flipped
+        
+        elif event.type == pygame.MOUSEWHEEL and self.replay:
+            self.seek_replay(self.replay.ply - event.y)
+        
+        elif event.type == pygame.KEYDOWN and self.puzzle:
+            # Ctrl+N: Next puzzle
+            if event.key == pygame.K_n and (event.mod & pygame.KMOD_CTRL):
+                self.next_puzzle()
+            
+            # Ctrl+R: Restart puzzle
+            elif event.key == pygame.K_r and (event.mod & pygame.KMOD_CTRL):
+                self.load_puzzle(self.puzzle)
+            
+            # Ctrl+M: Flip board only
+            elif event.key == pygame.K_m and (event.mod & pygame.KMOD_CTRL):
+                self.flipped = not self.flipped
+        
+        elif event.type == pygame.KEYDOWN:
+            # Ctrl+Z: Undo
+            if event.key == pygame.K_z and (event.mod & pygame.KMOD_CTRL):
+                self.undo_move()
             
-            # Draw
-            self.draw_board()
-            self.draw_legal_moves()
+            # Ctrl+R: Reset game
+            elif event.key == pygame.K_r and (event.mod & pygame.KMOD_CTRL):
+                self.reset_game()
+            
+            # Ctrl+M: Flip board / Switch sides
+            elif event.key == pygame.K_m and (event.mod & pygame.KMOD_CTRL):
+                self.flip_board()
+        
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            self.handle_mouse_down(event.pos, event.button)
+        
+        elif event.type == pygame.MOUSEBUTTONUP:
+            self.handle_mouse_up(event.pos, event.button)
+        
+        elif event.type == pygame.MOUSEMOTION:
+            self.handle_mouse_motion(event.pos)
+        
+        elif event.type == ENGINE_MOVE_EVENT:
+            self.handle_engine_result(event.move, event.fen, event.engine, event.error)
+        
+        elif event.type == BROADCAST_EVENT:
+            self.handle_broadcast(event.message)
+        
+        elif event.type == PUZZLE_NEXT_EVENT and self.puzzles:
+            self.next_puzzle()
+        
+        elif event.type == ANALYSIS_EVENT and self.analyzer:
+            self.report_analysis()
+    
+    def toggle_profiling(self):
+        if self.profiler is None:
+            self.profiler = ProfileSession()
+            print("Profiling started (Ctrl+P to stop)")
+            return
+        
+        tags = {
+            'fen': self.board.fen(),
+            'window': f"{self.window_width}x{self.window_height}",
+            'board_theme': self.config.board_theme,
+            'piece_theme': self.config.piece_theme,
+            'render_backend': 'texture' if isinstance(self.screen, TextureScreen) else 'surface',
+            'engine': type(self.engine).__name__ if self.engine else None,
+        }
+        paths = self.profiler.stop(tags)
+        self.profiler = None
+        print(f"Profile written: {', '.join(str(path) for path in paths)}")
+    
+    def print_memory_report(self):
+        report = self.assets.memory_report()
+        parts = ', '.join(f"{name} {size / 1024:.0f} KiB" for name, size in report.items())
+        print(f"Assets: {parts}; total {sum(report.values()) / 1024:.0f} KiB "
+              f"of {self.config.asset_memory_mb} MB")
+    
+    def draw_annotation_layer(self):
+        """Markers and arrows drawn into one cached layer (texture backend has no pygame.draw)"""
+        if not self.markers and not self.arrows:
+            return
+        key = (tuple(marker.square for marker in self.markers),
+               tuple((arrow.start, arrow.end) for arrow in self.arrows),
+               self.flipped, self.window_width, self.window_height,
+               self.config.marker_color, self.config.marker_thickness, self.config.marker_radius_ratio,
+               self.config.arrow_color, self.config.arrow_thickness)
+        if self.annotation_layer[0] != key:
+            layer = pygame.Surface((self.window_width, self.window_height), pygame.SRCALPHA)
+            screen, self.screen = self.screen, layer
+            try:
+                self.draw_markers()
+                self.draw_arrows()
+            finally:
+                self.screen = screen
+            self.annotation_layer = (key, layer)
+        self.screen.blit(self.annotation_layer[1], (0, 0))
+    
+    def draw(self):
+        texture_backend = isinstance(self.screen, TextureScreen)
+        if texture_backend:
+            self.screen.fill((0, 0, 0))
+        self.draw_board()
+        self.draw_premoves()
+        self.draw_legal_moves()
+        if texture_backend:
+            self.draw_annotation_layer()
+        else:
             self.draw_markers()
             self.draw_arrows()
-            self.draw_pieces()
-            self.draw_animating_piece()
-            self.draw_dragging_piece()
-            
+        self.draw_pieces()
+        self.draw_animating_piece()
+        self.draw_dragging_piece()
+        if self.analyzer:
+            self.draw_eval_graph()
+        if self.replay:
+            self.draw_replay_bar()
+        
+        if texture_backend:
+            self.screen.flip()
+        else:
             pygame.display.flip()
-            self.clock.tick(60)
+    
+    def run(self):
+        while self.running:
+            state = self.frame_state()
+            for event in self.scheduler.next_events(state):
+                try:
+                    self.handle_event(event)
+                except GameServerRejected as e:
+                    self.handle_rejection(e)
+                self.needs_redraw = True
+            
+            if self.analyzer:
+                self.sync_analysis()
+            
+            # Pick up config.json edits
+            changed = self.config_watcher.poll()
+            if changed:
+                self.apply_config_changes(changed)
+                self.needs_redraw = True
+            
+            # Draw only when something changed or is moving
+            if self.needs_redraw or state != FrameState.IDLE:
+                self.draw()
+                # One more frame after an animation ends to settle the pieces
+                self.needs_redraw = state == FrameState.ANIMATING and not self.animating
             
             # Engine move
             if not self.animating and not self.dragging_piece:
-                self.engine_move()
+                try:
+                    self.engine_move()
+                except GameServerRejected as e:
+                    self.handle_rejection(e)
         
-        self.engine.close()
+        if self.profiler:
+            self.toggle_profiling()
+        self.print_memory_report()
+        if self.engine:
+            stats = self.engine.stats()
+            print(f"Engine: {stats['searches']} searches, {stats['restarts']} restarts, "
+                  f"p50 {stats['p50']:.3f}s p95 {stats['p95']:.3f}s p99 {stats['p99']:.3f}s")
+            self.engine.close()
+        if self.broadcaster:
+            self.broadcaster.close()
+        if self.spectator_feed:
+            self.spectator_feed.close()
+        if self.analyzer:
+            self.analyzer.close()
         pygame.quit()
 
-def main():
+class DiagramRenderer(BoardView):
+    """Render positions to an off-screen surface with the configured themes"""
+    
+    def __init__(self, config: Config, size: int = 320):
+        self.config = config
+        self.assets = AssetManager(config, load_sounds=False)
+        self.window_width = size
+        self.window_height = size
+        self.screen = pygame.Surface((size, size))
+        self.overlays = {}
+        
+        self.board = chess.Board()
+        self.flipped = False
+        self.markers: List[Marker] = []
+        self.arrows: List[Arrow] = []
+        self.last_move_from = None
+        self.last_move_to = None
+        
+        # Interactive state BoardView checks; always idle here
+        self.selected_square = None
+        self.dragging_piece = None
+        self.dragging_from_square = None
+        self.animating = False
+        self.anim_piece = None
+        self.anim_queue = []
+        self.anim_board_states = []
+        self.current_anim_index = 0
+    
+    def render(self, board: chess.Board, last_move: Optional[chess.Move] = None,
+               arrows: Optional[List[Arrow]] = None, markers: Optional[List[Marker]] = None,
+               flipped: bool = False) -> pygame.Surface:
+        self.board = board
+        self.flipped = flipped
+        self.arrows = arrows or []
+        self.markers = markers or []
+        if last_move:
+            self.last_move_from = (chess.square_file(last_move.from_square), chess.square_rank(last_move.from_square))
+            self.last_move_to = (chess.square_file(last_move.to_square), chess.square_rank(last_move.to_square))
+        else:
+            self.last_move_from = self.last_move_to = None
+        
+        self.draw_board()
+        self.draw_pieces()
+        self.draw_markers()
+        self.draw_arrows()
+        return self.screen
+
+def _square(square: chess.Square) -> Tuple[int, int]:
+    return (chess.square_file(square), chess.square_rank(square))
+
+def iter_diagrams(stream, input_format: str, every_ply: bool = False):
+    """Yield (name, fen, last_move, arrows, markers) for each diagram in the input
+
+    fen: one FEN per line, optionally followed by '; <uci moves>' played from it
+         (the last move is highlighted).
+    epd: one EPD per line; 'bm' moves become arrows, 'id' names the file.
+    pgn: the final position of each game, or every ply with every_ply;
+         [%cal]/[%csl] comments become arrows/markers.
+    """
+    index = 0
+    if input_format == 'pgn':
+        while True:
+            game = chess.pgn.read_game(stream)
+            if game is None:
+                break
+            index += 1
+            nodes = list(game.mainline()) if every_ply else [game.end()]
+            for node in nodes:
+                board = node.board()
+                last_move = node.move if node.parent else None
+                arrows = [Arrow(_square(a.tail), _square(a.head)) for a in node.arrows() if a.tail != a.head]
+                markers = [Marker(_square(a.tail)) for a in node.arrows() if a.tail == a.head]
+                name = f"{index:06d}_{board.ply():03d}" if every_ply else f"{index:06d}"
+                yield name, board.fen(), last_move, arrows, markers
+        return
+    
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        index += 1
+        try:
+            if input_format == 'epd':
+                board, operations = chess.Board.from_epd(line)
+                best_moves = operations.get('bm', [])
+                arrows = [Arrow(_square(move.from_square), _square(move.to_square)) for move in best_moves]
+                name = str(operations.get('id', f"{index:06d}")).replace('/', '_')
+                yield name, board.fen(), None, arrows, []
+            else:
+                moves = ''
+                if ';' in line:
+                    line, moves = (part.strip() for part in line.split(';', 1))
+                board = chess.Board(line)
+                last_move = None
+                for token in moves.split():
+                    last_move = board.parse_uci(token)
+                    board.push(last_move)
+                yield f"{index:06d}", board.fen(), last_move, [], []
+        except ValueError as e:
+            print(f"Skipping line {index}: {e}", file=sys.stderr)
+
+# Per-process renderer of chess-diagram workers; sprites are scaled once per worker
+_diagram_renderer: Optional[DiagramRenderer] = None
+
+def _init_diagram_worker(config_path: str, size: int):
+    global _diagram_renderer
+    pygame.font.init()
+    _diagram_renderer = DiagramRenderer(Config(config_path), size)
+
+def _render_diagram(job) -> str:
+    path, fen, last_move, arrows, markers, flipped = job
+    surface = _diagram_renderer.render(chess.Board(fen), last_move, arrows, markers, flipped)
+    pygame.image.save(surface, path)
+    return path
+
+def diagram_main(argv: Optional[List[str]] = None):
+    """Command-line entry point: render FEN/EPD/PGN positions to PNG diagrams"""
+    parser = argparse.ArgumentParser(
+        prog='chess-diagram',
+        description='Render FEN, EPD or PGN positions to PNG board diagrams'
+    )
+    parser.add_argument('input', nargs='?', default='-',
+                        help="input file, may be .gz/.bz2 ('-' for stdin)")
+    parser.add_argument('-f', '--input-format', choices=['fen', 'epd', 'pgn'],
+                        help='input format (default: guessed from file extension, else fen)')
+    parser.add_argument('-o', '--output', default='diagrams',
+                        help='output directory (default: %(default)s)')
+    parser.add_argument('-s', '--size', type=int, default=320,
+                        help='image width and height in pixels (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: %(default)s)')
+    parser.add_argument('--orientation', choices=['white', 'black', 'turn'], default='white',
+                        help="board orientation; 'turn' puts the side to move at the bottom")
+    parser.add_argument('--every-ply', action='store_true',
+                        help='PGN: one diagram per ply instead of the final position')
+    args = parser.parse_args(argv)
+    
+    input_format = args.input_format
+    if input_format is None:
+        name = args.input.lower()
+        for suffix in ('.gz', '.bz2'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        input_format = name.rsplit('.', 1)[-1] if name.endswith(('.pgn', '.epd')) else 'fen'
+    
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    config_path = str(CONFIG_FILE)
+    
+    def jobs(stream):
+        for name, fen, last_move, arrows, markers in iter_diagrams(stream, input_format, args.every_ply):
+            black_to_move = fen.split()[1] == 'b'
+            flipped = args.orientation == 'black' or (args.orientation == 'turn' and black_to_move)
+            yield str(output_dir / f"{name}.png"), fen, last_move, arrows, markers, flipped
+    
+    start = time.monotonic()
+    count = 0
+    stream = open_text(args.input)
+    try:
+        if args.jobs <= 1:
+            _init_diagram_worker(config_path, args.size)
+            for job in jobs(stream):
+                _render_diagram(job)
+                count += 1
+        else:
+            with multiprocessing.Pool(args.jobs, _init_diagram_worker, (config_path, args.size)) as pool:
+                for _ in pool.imap_unordered(_render_diagram, jobs(stream), chunksize=64):
+                    count += 1
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    print(f"Rendered {count} diagrams to {output_dir} in {time.monotonic() - start:.1f}s")
+
+def asset_pack_main(argv: Optional[List[str]] = None):
+    """Command-line entry point: build or inspect the packed assets"""
+    config = Config()
+    parser = argparse.ArgumentParser(prog='chess-assets', description='Build or inspect the asset pack')
+    parser.add_argument('--pack', default=config.asset_pack, help='pack file (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='pack all themes, boards and sounds into one file')
+    build_parser.add_argument('--source', default=str(ASSETS_DIR), help='asset directory (default: %(default)s)')
+    build_parser.add_argument('-s', '--sizes', type=int, nargs='*', default=[],
+                              help='square sizes in pixels to pre-scale images to, e.g. 60 80 100')
+    commands.add_parser('list', help='print the packed assets')
+    args = parser.parse_args(argv)
+    
+    if args.command == 'build':
+        source = Path(args.source)
+        if not source.is_dir():
+            sys.exit(f"No asset directory at {source}")
+        start = time.monotonic()
+        count, size = build_asset_pack(source, Path(args.pack), args.sizes)
+        print(f"Packed {count} files into {args.pack} ({size // 1024} KiB) in {time.monotonic() - start:.1f}s")
+    else:
+        try:
+            pack = AssetPack(Path(args.pack))
+        except (OSError, ValueError) as e:
+            sys.exit(f"Cannot read {args.pack} ({e})")
+        for name, entry in pack.entries.items():
+            variants = ' '.join(f"{width}x{height}" for width, height, _, _ in entry.get('scaled', []))
+            print(f"{entry['length']:>9}  {name}  {variants}".rstrip())
+        pack.close()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='chess', description='Offline chess')
+    parser.add_argument('--replay', metavar='PGN', help='open a PGN game in the replay viewer')
+    parser.add_argument('--game', type=int, default=1, help='game number in the PGN file (default: 1)')
+    args = parser.parse_args(argv)
+    
     config = Config()
-    ui = ChessUI(config)
+    replay = None
+    if args.replay:
+        with open(args.replay, 'r') as f:
+            replay = GameReplay.from_pgn(f, args.game - 1)
+        if replay is None:
+            sys.exit(f"No game {args.game} in {args.replay}")
+    
+    ui = ChessUI(config, replay)
     ui.run()
 
 if __name__ == '__main__':
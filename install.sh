@@ -66,7 +66,13 @@ fi
 # 7️⃣ Shell cache temizle
 hash -r || true
 
-# 8️⃣ Son kontrol
+# 8️⃣ Varlık paketi (tek dosya, hızlı açılış)
+if command -v chess-assets &> /dev/null; then
+  echo "📦 Varlık paketi oluşturuluyor..."
+  chess-assets build || echo "⚠️  Varlık paketi oluşturulamadı; görseller tek tek yüklenecek."
+fi
+
+# 9️⃣ Son kontrol
 echo ""
 if command -v chess &> /dev/null; then
   echo "✅ Kurulum başarılı!"
@@ -12,6 +12,13 @@ setup(
     entry_points={
         "console_scripts": [
             "chess=chess_app:main",
+            "chess-notation=chess_app:notation_main",
+            "chess-engined=chess_app:engine_daemon_main",
+            "chess-server=chess_app:game_server_main",
+            "chess-puzzles=chess_app:puzzle_main",
+            "chess-calibrate=chess_app:calibrate_main",
+            "chess-diagram=chess_app:diagram_main",
+            "chess-assets=chess_app:asset_pack_main",
         ],
     },
 )
@@ -0,0 +1,103 @@
+import io
+import random
+import sqlite3
+
+import pytest
+
+from chess_app import PuzzleStore
+
+FEN = 'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3'
+
+
+def csv_rows(ratings, themes='fork short'):
+    lines = ['PuzzleId,FEN,Moves,Rating,RatingDeviation,Popularity,NbPlays,Themes']
+    for i, rating in enumerate(ratings):
+        lines.append(f'p{i},{FEN},f1b5 a7a6,{rating},75,90,100,{themes}')
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PuzzleStore(str(tmp_path / 'puzzles.db'))
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize('theme', ['', 'fork'])
+def test_random_picks_spread_over_all_puzzles(store, theme):
+    random.seed(1)
+    store.import_csv(io.StringIO(csv_rows([1500 + i % 10 for i in range(5000)])))
+
+    picks = [store.random(1500, 1509, theme).puzzle_id for _ in range(3000)]
+
+    # Random-key seeks weight each puzzle by the gap before its key, which
+    # gives about 1875 distinct puzzles for 3000 draws out of 5000
+    assert len(set(picks)) > 1700
+    assert max(picks.count(pick) for pick in set(picks)) < 20
+    for rating in range(1500, 1510):
+        share = sum(1 for pick in picks if int(pick[1:]) % 10 == rating - 1500) / len(picks)
+        assert 0.05 < share < 0.15
+
+
+def test_random_does_not_favour_puzzle_after_rating_gap(store):
+    random.seed(2)
+    store.import_csv(io.StringIO(csv_rows([1000] * 100 + [3000] * 100)))
+
+    picks = [store.random(0, 4000).puzzle_id for _ in range(2000)]
+
+    # Most random ratings fall in the gaps and land on the first puzzle of the next rating
+    assert max(picks.count(pick) for pick in set(picks)) < 100
+    assert len(set(picks)) > 150
+
+
+@pytest.mark.parametrize('theme', ['', 'fork'])
+def test_random_weights_ratings_by_puzzle_count(store, theme):
+    random.seed(3)
+    store.import_csv(io.StringIO(csv_rows([1000] + [3000] * 1000)))
+
+    picks = [store.random(0, 4000, theme) for _ in range(4000)]
+
+    # The lone 1000 puzzle is one of 1001, not one of two ratings
+    lone = sum(1 for puzzle in picks if puzzle.rating == 1000)
+    assert lone < 20
+    # Random-key seeks give about 800 distinct puzzles for 4000 draws out of 1000
+    assert len({puzzle.puzzle_id for puzzle in picks}) > 700
+
+
+def test_random_respects_band_and_theme(store):
+    store.import_csv(io.StringIO(csv_rows([1200, 1800, 2400])))
+
+    assert store.random(1700, 1900).rating == 1800
+    assert store.random(0, 4000, 'mateIn2') is None
+    assert store.random(2500, 4000) is None
+
+
+def test_import_skips_bad_rows(store):
+    data = csv_rows([1500, 1600]) + f'bad,{FEN},f1b5,unrated,75,90,100,fork\nshort,{FEN}\n'
+
+    assert store.import_csv(io.StringIO(data)) == (2, 2)
+    assert store.count() == 2
+
+
+def test_database_from_before_random_keys_is_migrated(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE puzzles (id INTEGER PRIMARY KEY, puzzle_id TEXT NOT NULL UNIQUE, fen TEXT NOT NULL,
+                              moves TEXT NOT NULL, rating INTEGER NOT NULL, themes TEXT NOT NULL);
+        CREATE INDEX puzzles_rating ON puzzles (rating);
+        CREATE TABLE puzzle_themes (theme TEXT NOT NULL, rating INTEGER NOT NULL, puzzle INTEGER NOT NULL,
+                                    PRIMARY KEY (theme, rating, puzzle)) WITHOUT ROWID;
+    """)
+    conn.executemany('INSERT INTO puzzles (puzzle_id, fen, moves, rating, themes) VALUES (?, ?, ?, 1500, ?)',
+                     [(f'p{i}', FEN, 'f1b5 a7a6', 'fork') for i in range(200)])
+    conn.execute("INSERT INTO puzzle_themes SELECT 'fork', rating, id FROM puzzles")
+    conn.commit()
+    conn.close()
+
+    store = PuzzleStore(path)
+    try:
+        picks = {store.random(1500, 1500, 'fork').puzzle_id for _ in range(200)}
+        assert len(picks) > 80
+    finally:
+        store.close()